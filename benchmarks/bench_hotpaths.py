@@ -0,0 +1,214 @@
+"""
+Times the render and codec hot paths headlessly and writes the results as JSON.
+
+Run from the repository root:
+    python -m benchmarks.bench_hotpaths --output bench.json
+    python -m benchmarks.bench_hotpaths --compare bench.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+
+from benchmarks.fixture_backend import FixtureBackend, load_fixtures, make_registration_qr
+from blackjackremote import blackjackcard
+from blackjackremote.blackjackprogram import BlackJackProgram
+from blackjackremote.game_state import GameState
+from blackjackvm import BlackJackSession
+from data.image_half_colour import OCSimpleImage, FORMAT_RGB, FORMAT_INDEXED
+from data.loader import ChipsSmall
+from virtual_desktop.button import Button
+from virtual_desktop.coin_button import CoinButton
+from virtual_desktop.screensize import ScreenSize
+
+MIN_TIME = 0.5
+MIN_ITERATIONS = 20
+MAX_ITERATIONS = 10000
+REGRESSION_THRESHOLD = 1.25
+
+
+def time_call(function, min_time=MIN_TIME):
+    """
+    Calls function repeatedly until min_time has passed
+    :return: The duration of each call in seconds
+    """
+    function()
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < MAX_ITERATIONS and (len(samples) < MIN_ITERATIONS or time.perf_counter() - started < min_time):
+        call_start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - call_start)
+    return samples
+
+
+def summarize(name, samples):
+    ordered = sorted(samples)
+    return {
+        "name": name,
+        "iterations": len(samples),
+        "mean_us": statistics.fmean(samples) * 1e6,
+        "median_us": statistics.median(samples) * 1e6,
+        "p95_us": ordered[int(len(ordered) * 0.95) - 1] * 1e6,
+        "min_us": ordered[0] * 1e6,
+    }
+
+
+def logged_in_program(raw_state: str) -> BlackJackProgram:
+    program = BlackJackProgram(pygame.Surface((160, 100)), FixtureBackend())
+    program.username = "benchmark"
+    program.auth = "token-benchmark"
+    program.game_state = GameState.parse(raw_state)
+    return program
+
+
+def program_screens(fixtures):
+    """
+    A program showing each screen, keyed by screen name
+    """
+    screens = {}
+    login = BlackJackProgram(pygame.Surface((160, 100)), FixtureBackend())
+    for keycode in (98, 101, 110, 99, 104):
+        login.key_input(keycode, 0)
+    login.login_error_text = "username taken"
+    screens["login"] = login
+
+    registration = BlackJackProgram(pygame.Surface((160, 100)), FixtureBackend())
+    registration.registration_qr = make_registration_qr()
+    screens["registration"] = registration
+
+    totp = BlackJackProgram(pygame.Surface((160, 100)), FixtureBackend())
+    totp.username = "benchmark"
+    for keycode in (49, 50, 51):
+        totp.key_input(keycode, 0)
+    screens["totp"] = totp
+
+    for phase, raw_state in fixtures.items():
+        screens[phase] = logged_in_program(raw_state)
+    return screens
+
+
+def full_render(program: BlackJackProgram):
+    def render():
+        # forget what is on screen so every element is redrawn, like the first frame of a screen
+        program.compositor.screen_key = None
+        program.render()
+    return render
+
+
+def benchmarks(fixtures):
+    playermove = logged_in_program(fixtures["playermove"])
+    playermove.render()
+    frame = OCSimpleImage(playermove.screen)
+    serialized = frame.serialize()
+    serialized_rle = frame.serialize_rle()
+    changed = logged_in_program(fixtures["playermove_split"])
+    changed.render()
+    changed_frame = OCSimpleImage(changed.screen)
+    registration_qr = make_registration_qr()
+
+    yield "codec.serialize", frame.serialize
+    yield "codec.serialize_rle", frame.serialize_rle
+    yield "codec.serialize_delta", lambda: changed_frame.serialize_delta(frame)
+    yield "codec.serialize_binary_rgb", lambda: frame.serialize_binary(FORMAT_RGB)
+    yield "codec.serialize_binary_indexed", lambda: frame.serialize_binary(FORMAT_INDEXED)
+    yield "codec.from_surface", lambda: OCSimpleImage(playermove.screen)
+    yield "codec.deserialize", lambda: OCSimpleImage().deserialize(serialized).get_surface()
+    yield "codec.deserialize_rle", lambda: OCSimpleImage().deserialize(serialized_rle).get_surface()
+    yield "codec.deserialize_qr_scale2", lambda: OCSimpleImage().deserialize(registration_qr, 2).get_surface()
+
+    yield "card.render", lambda: [blackjackcard.render(card, ScreenSize.SMALL) for card in range(-1, 52)]
+    yield "card.build_sprites", lambda: blackjackcard.build_card_sprites(ScreenSize.SMALL)
+
+    button = Button(pygame.Rect(60, 40, 40, 13), "Register", (255, 255, 255), (0, 0, 0))
+    coin = CoinButton((0, 0), "+25", ChipsSmall.chips[2], (220, 190, 80))
+    yield "button.render", button.render
+    yield "button.draw", button.draw
+    yield "coin_button.render", coin.render
+    yield "coin_button.draw", coin.draw
+
+    for screen, program in program_screens(fixtures).items():
+        yield f"program.render.{screen}", full_render(program)
+        yield f"program.render.{screen}.unchanged", program.render
+
+    for mode, setup_lines in (("ascii", []), ("delta", [b"mode delta\n"]), ("indexed_delta", [b"mode delta\n", b"format indexed\n"])):
+        session = BlackJackSession(backend_client=FixtureBackend())
+        session.first_frame()
+        for line in setup_lines:
+            session.handle_line(line)
+        # type a letter then delete it so every input changes the screen
+        lines = [b"key 97 0\n", b"key 8 0\n"]
+        yield f"e2e.key_to_frame.{mode}", lambda session=session, lines=lines: \
+            session.handle_line(lines[len(session.game.username_field.get_string()) % 2])
+
+    session = BlackJackSession(backend_client=FixtureBackend())
+    session.first_frame()
+    session.game.username = "benchmark"
+    session.game.auth = "token-benchmark"
+    session.game.game_state = GameState.parse(session.game.backend.poll("benchmark", "token-benchmark"))
+    session.first_frame()
+    add_coin = session.game.add_coins[0].pos.center
+    remove_coin = session.game.remove_coins[0].pos.center
+    clicks = [f"click {add_coin[0]} {add_coin[1]}\n".encode(), f"click {remove_coin[0]} {remove_coin[1]}\n".encode()]
+    yield "e2e.bet_click_to_frame.ascii", lambda: session.handle_line(clicks[0 if session.game.game_state.bet_amount == 0 else 1])
+
+
+def compare(results, baseline_path, threshold):
+    with open(baseline_path) as f:
+        baseline = {result["name"]: result for result in json.load(f)["results"]}
+    regressions = []
+    for result in results:
+        previous = baseline.get(result["name"])
+        if previous is not None and result["median_us"] > previous["median_us"] * threshold:
+            regressions.append((result["name"], previous["median_us"], result["median_us"]))
+    for name, before, after in regressions:
+        print(f"REGRESSION {name}: {before:.1f}us -> {after:.1f}us", file=sys.stderr)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="write results here instead of stdout")
+    parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this")
+    parser.add_argument("--min-time", type=float, default=MIN_TIME, help="seconds to spend on each benchmark")
+    parser.add_argument("--compare", help="results from an earlier run to check for regressions against")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="median slowdown ratio that counts as a regression")
+    args = parser.parse_args()
+
+    results = []
+    # the program prints debugging output, keep it out of the results
+    with contextlib.redirect_stdout(sys.stderr):
+        for name, function in benchmarks(load_fixtures()):
+            if args.filter in name:
+                results.append(summarize(name, time_call(function, args.min_time)))
+                print(f"{name}: {results[-1]['median_us']:.1f}us median", file=sys.stderr)
+
+    report = {
+        "python": platform.python_version(),
+        "pygame": pygame.version.ver,
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
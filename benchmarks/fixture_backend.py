@@ -0,0 +1,106 @@
+import json
+import os
+
+import numpy as np
+from PIL import Image
+
+from data.image_half_colour import OCSimpleImage
+
+FIXTURES_PATH = os.path.join(os.path.dirname(__file__), "fixtures", "game_states.json")
+
+
+def load_fixtures(path: str = FIXTURES_PATH) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def make_registration_qr(size: int = 40) -> str:
+    """
+    A deterministic QR-like pattern serialized the way the backend sends registration codes
+    """
+    modules = np.random.default_rng(size).integers(0, 2, (size // 2, size // 2), dtype=np.uint8)
+    pixels = np.repeat(np.repeat(modules * 255, 2, axis=0), 2, axis=1)
+    return OCSimpleImage(Image.fromarray(np.stack((pixels,) * 3, axis=2), mode="RGB")).serialize()
+
+
+class FixtureGame:
+    """
+    Walks through the recorded replies as a small state machine, standing in for the blackjack backend.
+    Bets change the bet amount so betting clicks produce new frames
+    """
+    PAYOUTS = ("payout_won", "payout_tie", "payout_loss")
+
+    def __init__(self, fixtures: dict = None) -> None:
+        super().__init__()
+        self.fixtures = fixtures if fixtures is not None else load_fixtures()
+        self.registration_qr = make_registration_qr()
+        self.phase = "betting"
+        self.bet = 0
+        self.rounds = 0
+
+    def current(self) -> str:
+        if self.phase == "betting":
+            game_data = self.fixtures["betting"].split("\n")
+            return f"success\nbetting {self.bet}\n{game_data[2]}"
+        return self.fixtures[self.phase]
+
+    def reply(self, path: str, form: dict) -> str:
+        """
+        :param path: The backend path that was posted to
+        :param form: The posted form fields
+        :return: The reply text
+        """
+        if path == "/auth/register":
+            if not form.get("username"):
+                return "failed\nusername required"
+            return f"success\n{self.registration_qr}"
+        if path == "/auth/login":
+            return f"success\ntoken-{form.get('username')}"
+        if form.get("action") == "poll":
+            return self.current()
+        return self.move(form.get("move", ""))
+
+    def move(self, move: str) -> str:
+        if self.phase == "betting" and move.startswith("bet"):
+            self.bet = max(0, self.bet + int(move[3:]))
+        elif self.phase == "betting" and move == "submitbet":
+            self.phase = "playermove"
+        elif self.phase.startswith("playermove"):
+            self.phase = "dealermove"
+        elif self.phase == "dealermove" and move == "ack":
+            self.phase = self.PAYOUTS[self.rounds % len(self.PAYOUTS)]
+        elif self.phase.startswith("payout") and move == "ack":
+            self.phase = "continueplaying"
+        elif self.phase == "continueplaying" and move == "yes":
+            self.phase = "betting"
+            self.bet = 0
+            self.rounds += 1
+        elif self.phase == "continueplaying" and move == "no":
+            self.phase = "betting"
+            self.bet = 0
+            return "success\nGAME OVER"
+        else:
+            return "failed\ninvalid move"
+        return self.current()
+
+
+class FixtureBackend:
+    """
+    In-process stand-in for BackendClient that answers from a FixtureGame without any network
+    """
+
+    def __init__(self, game: FixtureGame = None) -> None:
+        super().__init__()
+        self.game = game if game is not None else FixtureGame()
+
+    def register(self, username: str) -> str:
+        return self.game.reply("/auth/register", {"username": username})
+
+    def login(self, username: str, totp: str) -> str:
+        return self.game.reply("/auth/login", {"username": username, "totp": totp})
+
+    def poll(self, username: str, auth: str) -> str:
+        return self.game.reply("/game/blackjack", {"username": username, "auth": auth, "action": "poll"})
+
+    def input(self, username: str, auth: str, move: str) -> str:
+        return self.game.reply("/game/blackjack", {"username": username, "auth": auth, "action": "input", "move": move})
@@ -0,0 +1,70 @@
+"""
+Serves the recorded game states over HTTP in place of the blackjack backend, so a BlackJackVM server can be load
+tested without network access. Every username gets its own FixtureGame.
+
+Run from the repository root:
+    python -m benchmarks.fixture_server
+"""
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+from benchmarks.fixture_backend import FixtureGame, load_fixtures
+from blackjackremote.backend import BLACKJACK_BACKEND
+
+
+class FixtureRequestHandler(BaseHTTPRequestHandler):
+    # keep connections alive like the real backend so the pooled client reuses them
+    protocol_version = "HTTP/1.1"
+    # headers and body go out in separate writes, with Nagle on the body waits for the client's delayed ack
+    disable_nagle_algorithm = True
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        form = dict(parse_qsl(self.rfile.read(length).decode("utf-8")))
+        reply = self.server.get_game(form.get("username", "")).reply(self.path, form).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+class FixtureServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=BLACKJACK_BACKEND) -> None:
+        super().__init__(address, FixtureRequestHandler)
+        self.fixtures = load_fixtures()
+        self.games = {}
+        self.games_lock = threading.Lock()
+
+    def get_game(self, username: str) -> FixtureGame:
+        with self.games_lock:
+            game = self.games.get(username)
+            if game is None:
+                game = self.games[username] = FixtureGame(self.fixtures)
+            return game
+
+
+def start_fixture_server(address=BLACKJACK_BACKEND) -> FixtureServer:
+    """
+    Starts serving on a background thread, call shutdown() on the returned server to stop
+    """
+    server = FixtureServer(address)
+    threading.Thread(target=server.serve_forever, name="fixture-backend", daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=BLACKJACK_BACKEND[0])
+    parser.add_argument("--port", type=int, default=BLACKJACK_BACKEND[1])
+    args = parser.parse_args()
+
+    with FixtureServer((args.host, args.port)) as server:
+        server.serve_forever()
@@ -0,0 +1,291 @@
+"""
+Opens many concurrent sessions to a BlackJackVM server and replays scripted play through them: logging in, then
+rounds of betting, hitting, acknowledging the payout and playing again. Reports input-to-frame latency percentiles,
+frames per second, bytes per frame and the server's resident memory as JSON.
+
+The blackjack backend is replaced by benchmarks.fixture_server, so no network is needed. Run from the repository root:
+    python -m benchmarks.load_test --spawn fork --sessions 50
+    python -m benchmarks.load_test --server-pid 1234 --sessions 200 --protocol indexed
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+
+from benchmarks.fixture_backend import FixtureBackend
+from benchmarks.fixture_server import start_fixture_server
+from blackjackremote.backend import BLACKJACK_BACKEND
+from blackjackremote.blackjackprogram import BlackJackProgram
+from blackjackvm import SERVER_IP
+from data.image_half_colour import FrameReader
+
+PROTOCOLS = {
+    "ascii": [],
+    "rle": [b"format rle\n"],
+    "delta": [b"mode delta\n"],
+    "indexed": [b"mode delta\n", b"format indexed\n"],
+    "ascii_zlib": [b"compress zlib\n"],
+    "indexed_zlib": [b"mode delta\n", b"format indexed\n", b"compress zlib\n"],
+}
+SERVER_START_TIMEOUT = 30
+# a frame taking longer than this counts as a failed session rather than hanging the run
+FRAME_TIMEOUT = 30
+RSS_SAMPLE_INTERVAL = 0.5
+
+
+def click(button) -> bytes:
+    return f"click {button.pos.centerx} {button.pos.centery}\n".encode()
+
+
+def type_text(text: str):
+    return [f"key {ord(char)} 0\n".encode() for char in text]
+
+
+class Scripts:
+    """
+    The input lines for logging in and for playing one round, aimed at where a fresh program puts its buttons
+    """
+
+    def __init__(self) -> None:
+        with contextlib.redirect_stdout(sys.stderr):
+            program = BlackJackProgram(pygame.Surface((160, 100)), FixtureBackend())
+        self.login_click = click(program.login_button)
+        self.login_submit_click = click(program.login_submit_button)
+        self.play_round = [
+            click(program.add_coins[0]),
+            click(program.submit_bet_button),
+            click(program.move_buttons["hit"]),
+            click(program.acknowledge_button),
+            click(program.acknowledge_button),
+            click(program.play_again_yes_button),
+        ]
+
+    def login(self, username: str):
+        return type_text(username) + [self.login_click] + type_text("123456") + [self.login_submit_click]
+
+
+class LoadStats:
+    def __init__(self) -> None:
+        self.latencies = []
+        self.frame_sizes = []
+        self.errors = []
+        self.sessions_completed = 0
+
+
+class FrameStream:
+    """
+    One session's received frames, counting the bytes read off the wire while waiting for each
+    """
+
+    def __init__(self, reader: asyncio.StreamReader) -> None:
+        self.reader = reader
+        self.frame_reader = FrameReader()
+        self.frames = []
+
+    async def receive_frame(self) -> int:
+        """
+        Waits for the next whole frame
+        :return: The number of bytes received while waiting, the frame's size on the wire when inputs go one at a time
+        """
+        received = 0
+        while not self.frames:
+            data = await asyncio.wait_for(self.reader.read(65536), FRAME_TIMEOUT)
+            if not data:
+                raise ConnectionError("server closed the connection")
+            received += len(data)
+            self.frames += self.frame_reader.feed(data)
+        self.frames.pop(0)
+        return received
+
+
+async def run_session(index: int, args, scripts: Scripts, stats: LoadStats) -> None:
+    await asyncio.sleep(index * args.ramp / max(args.sessions, 1))
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    frames = FrameStream(reader)
+    try:
+        await frames.receive_frame()
+        for line in PROTOCOLS[args.protocol]:
+            writer.write(line)
+            await frames.receive_frame()
+        for line in scripts.login(f"load{index}") + scripts.play_round * args.rounds:
+            started = time.perf_counter()
+            writer.write(line)
+            frame_size = await frames.receive_frame()
+            stats.latencies.append(time.perf_counter() - started)
+            stats.frame_sizes.append(frame_size)
+            if args.think_time:
+                await asyncio.sleep(args.think_time)
+        stats.sessions_completed += 1
+    finally:
+        writer.close()
+
+
+async def run_sessions(args, stats: LoadStats) -> None:
+    scripts = Scripts()
+    results = await asyncio.gather(*(run_session(index, args, scripts, stats) for index in range(args.sessions)),
+                                   return_exceptions=True)
+    stats.errors.extend(repr(result) for result in results if isinstance(result, BaseException))
+
+
+def process_tree_rss(pid: int):
+    """
+    Resident memory of a process and all of its descendants in kB, read from /proc so only available on Linux
+    """
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                total += next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except (OSError, StopIteration):
+            # the process exited while we looked, or it is a zombie without memory
+            pass
+    return total
+
+
+class RssSampler:
+    """
+    Samples the server's resident memory on a background thread, keeping the peak
+    """
+
+    def __init__(self, pid: int) -> None:
+        self.pid = pid
+        self.peak = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="rss-sampler", daemon=True)
+
+    def run(self) -> None:
+        while not self.stopped.is_set():
+            self.sample()
+            self.stopped.wait(RSS_SAMPLE_INTERVAL)
+
+    def sample(self) -> int:
+        rss = process_tree_rss(self.pid)
+        self.peak = max(self.peak, rss)
+        return rss
+
+
+def spawn_server(server_type: str, args) -> subprocess.Popen:
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    server = subprocess.Popen([sys.executable, "blackjackvm.py", "--server", server_type], cwd=repo_root,
+                              stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while True:
+        try:
+            socket.create_connection((args.host, args.port), timeout=1).close()
+            return server
+        except OSError:
+            if server.poll() is not None or time.monotonic() > deadline:
+                server.kill()
+                raise RuntimeError(f"{server_type} server did not start listening on {args.host}:{args.port}")
+            time.sleep(0.1)
+
+
+def percentile(ordered, fraction: float):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summarize(args, stats: LoadStats, elapsed: float, rss_idle, rss_final, rss_peak) -> dict:
+    latencies = sorted(latency * 1000 for latency in stats.latencies)
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "sessions": args.sessions,
+        "sessions_completed": stats.sessions_completed,
+        "errors": stats.errors[:20],
+        "error_count": len(stats.errors),
+        "protocol": args.protocol,
+        "rounds": args.rounds,
+        "think_time": args.think_time,
+        "elapsed_s": elapsed,
+        "frames": len(latencies),
+        "frames_per_second": len(latencies) / elapsed if elapsed else 0,
+        "rss_kb": {"idle": rss_idle, "final": rss_final, "peak": rss_peak},
+    }
+    if latencies:
+        report["latency_ms"] = {
+            "mean": statistics.fmean(latencies),
+            "p50": percentile(latencies, 0.5),
+            "p90": percentile(latencies, 0.9),
+            "p99": percentile(latencies, 0.99),
+            "max": latencies[-1],
+        }
+        report["bytes_per_frame"] = {
+            "mean": statistics.fmean(stats.frame_sizes),
+            "max": max(stats.frame_sizes),
+            "total": sum(stats.frame_sizes),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=SERVER_IP[1])
+    parser.add_argument("--sessions", type=int, default=20, help="concurrent connections")
+    parser.add_argument("--rounds", type=int, default=5, help="rounds each session plays after logging in")
+    parser.add_argument("--protocol", choices=PROTOCOLS, default="ascii", help="frame encoding the sessions ask for")
+    parser.add_argument("--think-time", type=float, default=0, help="seconds each session waits between inputs")
+    parser.add_argument("--ramp", type=float, default=1, help="seconds over which the sessions connect")
+    parser.add_argument("--spawn", choices=("fork", "async", "prefork"), help="start blackjackvm.py with this server type")
+    parser.add_argument("--server-pid", type=int, help="pid of an already running server, for memory readings")
+    parser.add_argument("--no-backend", action="store_true", help="don't start the fixture backend, one is already running")
+    parser.add_argument("--backend-port", type=int, default=BLACKJACK_BACKEND[1])
+    parser.add_argument("--output", help="write the report here instead of stdout")
+    args = parser.parse_args()
+
+    fixture_server = None if args.no_backend else start_fixture_server((BLACKJACK_BACKEND[0], args.backend_port))
+    server = spawn_server(args.spawn, args) if args.spawn else None
+    server_pid = server.pid if server is not None else args.server_pid
+    sampler = RssSampler(server_pid) if server_pid is not None and os.path.isdir("/proc") else None
+
+    stats = LoadStats()
+    try:
+        rss_idle = sampler.sample() if sampler is not None else None
+        if sampler is not None:
+            sampler.thread.start()
+        started = time.perf_counter()
+        asyncio.run(run_sessions(args, stats))
+        elapsed = time.perf_counter() - started
+        rss_final = rss_peak = None
+        if sampler is not None:
+            sampler.stopped.set()
+            rss_final = sampler.sample()
+            rss_peak = sampler.peak
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if fixture_server is not None:
+            fixture_server.shutdown()
+
+    report = summarize(args, stats, elapsed, rss_idle, rss_final, rss_peak)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if stats.errors:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Re-drives BlackJackSession from logs recorded with `blackjackvm.py --record DIRECTORY`, answering backend calls from
+the log, and reports how long each input took to render and encode now against how long it took when recorded.
+Recorded times include waiting on the backend, replayed ones don't.
+
+Backend requests are replayed in the foreground, so sessions recorded with push on get the same replies but apply
+them as soon as they are made. Run from the repository root:
+    python -m benchmarks.replay recordings/*.jsonl.gz
+"""
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+from blackjackremote.session_log import ReplayBackend, read_session_log
+from blackjackvm import BlackJackSession
+
+SLOWEST_EVENTS = 5
+
+
+def replayed_lines(event):
+    # an input event holds every line that was answered with its frame
+    return [line for line in event["line"].encode("utf-8").splitlines(keepends=True) if not line.startswith(b"push")]
+
+
+def replay_refresh(session) -> None:
+    # the recorded poll ran in the background, apply its reply in the foreground like everything else
+    game = session.game
+    try:
+        reply = game.backend.poll(game.username, game.auth)
+    except LookupError:
+        # the session ended before the poll was answered
+        return
+    game.on_refresh_reply(game.move_count, reply)
+
+
+def replay_once(events):
+    """
+    :return: The time each frame event took to replay in ms, None for events that weren't replayed
+    """
+    session = BlackJackSession(backend_client=ReplayBackend(events))
+    timings = []
+    for event in events:
+        started = time.perf_counter()
+        if event["kind"] == "first":
+            session.first_frame()
+        elif event["kind"] == "input" and replayed_lines(event):
+            session.handle_lines(replayed_lines(event))
+        elif event["kind"] == "update":
+            if event.get("refresh", False):
+                replay_refresh(session)
+            session.poll_update()
+        else:
+            timings.append(None)
+            continue
+        timings.append((time.perf_counter() - started) * 1000)
+    session.close()
+    return timings
+
+
+def replay_log(path: str, repeat: int) -> dict:
+    header, events = read_session_log(path)
+    runs = [replay_once(events) for _ in range(repeat)]
+    # the fastest of each event's runs is the least disturbed by everything else on the machine
+    replayed = [min(timings) if timings[0] is not None else None for timings in zip(*runs)]
+    frame_events = [(event, ms) for event, ms in zip(events, replayed) if ms is not None]
+    replayed_ms = sorted(ms for _, ms in frame_events)
+    slowest = sorted(frame_events, key=lambda pair: pair[1], reverse=True)[:SLOWEST_EVENTS]
+    return {
+        "log": path,
+        "recorded_at": header["started"],
+        "frames": len(frame_events),
+        "recorded_ms": sum(event["ms"] for event, _ in frame_events),
+        "replayed_ms": sum(replayed_ms),
+        "replayed_median_ms": statistics.median(replayed_ms) if replayed_ms else None,
+        "replayed_max_ms": replayed_ms[-1] if replayed_ms else None,
+        "slowest": [{"t": event["t"], "kind": event["kind"], "line": event.get("line"), "recorded_ms": event["ms"],
+                     "replayed_ms": ms, "bytes": event["bytes"]} for event, ms in slowest],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("logs", nargs="+", help="session logs to replay")
+    parser.add_argument("--repeat", type=int, default=3, help="replay each log this many times, keeping the fastest")
+    parser.add_argument("--output", help="write the report here instead of stdout")
+    args = parser.parse_args()
+
+    # the program prints debugging output, keep it out of the report
+    with contextlib.redirect_stdout(sys.stderr):
+        results = [replay_log(path, args.repeat) for path in args.logs]
+
+    report = {"results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
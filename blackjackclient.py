@@ -1,17 +1,79 @@
 import socket
+import threading
 
 from pygame import *
 
 from data import OCSimpleImage
+from data.image_half_colour import FrameReader
+
+
+class FrameDecoder(threading.Thread):
+    """
+    Receives and decodes frames off the main thread so drawing never waits on the network or decoding. When frames
+    arrive faster than they're shown only the newest picture is kept
+    """
+
+    def __init__(self, sock: socket.socket) -> None:
+        super().__init__(name="frame-decoder", daemon=True)
+        self.sock = sock
+        self.reader = FrameReader()
+        self.current_frame = None
+        self.lock = threading.Lock()
+        self.latest_pixels = None
+
+    def run(self) -> None:
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except OSError:
+                break
+            if not data:
+                break
+            self.decode(self.reader.feed(data))
+
+    def decode(self, frames) -> None:
+        if not frames:
+            return
+        # everything before the newest keyframe is painted over by it, deltas after it still have to be applied
+        newest_keyframe = max((index for index, (frame, binary) in enumerate(frames) if OCSimpleImage.is_keyframe(frame, binary)), default=0)
+        for frame, binary in frames[newest_keyframe:]:
+            if binary:
+                if self.current_frame is None:
+                    self.current_frame = OCSimpleImage()
+                self.current_frame.apply_binary(frame)
+            elif OCSimpleImage.is_delta(frame):
+                if self.current_frame is None:
+                    self.sock.sendall(b"keyframe\n")
+                else:
+                    self.current_frame.apply_delta(frame)
+            else:
+                self.current_frame = OCSimpleImage().deserialize(frame)
+        if self.current_frame is not None:
+            with self.lock:
+                # the next delta patches current_frame in place, so hand over a copy
+                self.latest_pixels = self.current_frame.pixels.copy()
+
+    def take_surface(self):
+        """
+        :return: The newest picture if it hasn't been taken yet, otherwise None
+        """
+        with self.lock:
+            pixels, self.latest_pixels = self.latest_pixels, None
+        if pixels is None:
+            return None
+        frame = OCSimpleImage()
+        frame.pixels = pixels
+        return frame.get_surface()
+
 
 with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
     sock.connect(("blackjack.dumfing.com", 6525))
+    sock.sendall(b"mode delta\nformat indexed\npush on\ncompress zlib\n")
     running = True
     screen = display.set_mode((640, 400))
-    screen_surf = Surface((160, 100))
     clockity = time.Clock()
-    receive_buffer = bytearray()
-    sock.setblocking(False)
+    decoder = FrameDecoder(sock)
+    decoder.start()
     display.set_icon(image.load('1_chip.png'))
     display.set_caption("Dumfing's Blackjack")
     while running:
@@ -19,19 +81,12 @@ with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
             if e.type == QUIT:
                 running = False
             elif e.type == KEYDOWN:
-                sock.send(f"key {e.key} {e.mod}\n".encode("utf-8"))
+                sock.sendall(f"key {e.key} {e.mod}\n".encode("utf-8"))
             elif e.type == MOUSEBUTTONDOWN:
-                sock.send(f"click {e.pos[0] // 4} {e.pos[1] // 4}\n".encode("utf-8"))
-
-        try:
-            receive_buffer.extend(sock.recv(8192))
-        except BlockingIOError:
-            pass
-        frames = receive_buffer.split(b"\n")
-        if len(frames) > 1:
-            screen_surf = OCSimpleImage().deserialize(frames[0].decode('utf-8')).get_surface()
-            receive_buffer = bytearray(b'\n'.join(frames[1:]))
+                sock.sendall(f"click {e.pos[0] // 4} {e.pos[1] // 4}\n".encode("utf-8"))
 
+        screen_surf = decoder.take_surface()
+        if screen_surf is not None:
             screen.blit(transform.scale(screen_surf, (screen.get_width(), screen.get_height())), (0, 0))
             display.flip()
         clockity.tick(30)
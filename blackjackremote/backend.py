@@ -0,0 +1,92 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from blackjackremote import metrics
+
+BLACKJACK_BACKEND = ("127.0.0.1", 6595)
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 10
+POLL_RETRIES = 2
+POOL_SIZE = 32
+EXECUTOR_WORKERS = 16
+
+
+class BackendClient:
+    """
+    Talks to the blackjack backend over a pooled keep-alive session, every method returns the reply's text
+    """
+
+    def __init__(self, address=BLACKJACK_BACKEND, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 poll_retries=POLL_RETRIES, pool_size=POOL_SIZE) -> None:
+        super().__init__()
+        self.base_url = f"http://{address[0]}:{address[1]}"
+        self.timeout = (connect_timeout, read_timeout)
+        self.poll_retries = poll_retries
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+
+    def post(self, path: str, data: dict) -> str:
+        with metrics.timed("backend", data.get("action", path.rsplit("/", 1)[-1])):
+            return self.session.post(f"{self.base_url}{path}", data, timeout=self.timeout).text
+
+    def register(self, username: str) -> str:
+        return self.post("/auth/register", {"username": username})
+
+    def login(self, username: str, totp: str) -> str:
+        return self.post("/auth/login", {"username": username, "totp": totp})
+
+    def poll(self, username: str, auth: str) -> str:
+        """
+        Fetches the current game state, polling changes nothing on the backend so failed attempts are retried
+        """
+        for attempt in range(self.poll_retries + 1):
+            try:
+                return self.post("/game/blackjack", {"username": username, "auth": auth, "action": "poll"})
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.poll_retries:
+                    raise
+
+    def input(self, username: str, auth: str, move: str) -> str:
+        return self.post("/game/blackjack", {"username": username, "auth": auth, "action": "input", "move": move})
+
+
+_backend = None
+_backend_pid = None
+_backend_settings = {}
+_executor = None
+_executor_pid = None
+
+
+def get_backend() -> BackendClient:
+    """
+    The client shared by every session in this process, a forked child builds its own so connections aren't shared
+    """
+    global _backend, _backend_pid
+    if _backend is None or _backend_pid != os.getpid():
+        _backend = BackendClient(**_backend_settings)
+        _backend_pid = os.getpid()
+    return _backend
+
+
+def configure_backend(**settings) -> None:
+    """
+    Sets the BackendClient arguments used by get_backend from now on
+    """
+    global _backend
+    _backend_settings.clear()
+    _backend_settings.update(settings)
+    _backend = None
+
+
+def get_backend_executor() -> ThreadPoolExecutor:
+    """
+    The executor shared by every session in this process for running backend requests in the background
+    """
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS, thread_name_prefix="backend")
+        _executor_pid = os.getpid()
+    return _executor
@@ -9,7 +9,30 @@ class CardSizes:
     SMALL = (12, 16)
 
 
+# built card faces for each screen size, keyed by card value with -1 as the back
+_card_sprites = {}
+
+
 def render(card_value: int, screen_size: ScreenSize):
+    """
+    Looks up the sprite for a card, the returned surface is shared so it must only be blitted, never drawn on
+    :param card_value: 0-51, or -1 for a face down card
+    :param screen_size: The size to draw the card at
+    :return: The card's sprite
+    """
+    sprites = _card_sprites.get(screen_size)
+    if sprites is None:
+        sprites = build_card_sprites(screen_size)
+    return sprites[card_value]
+
+
+def build_card_sprites(screen_size: ScreenSize):
+    sprites = {card_value: _draw_card(card_value, screen_size) for card_value in range(-1, 52)}
+    _card_sprites[screen_size] = sprites
+    return sprites
+
+
+def _draw_card(card_value: int, screen_size: ScreenSize):
     if card_value == -1:
         return card_small_back.copy()
     card_suit = Suit.from_card(card_value)
@@ -35,20 +58,10 @@ class Suit(enum.IntEnum):
         return Suit(card // 13)
 
     def get_colour(self) -> Tuple[int, int, int]:
-        return {
-            Suit.HEARTS: (255, 0, 0),
-            Suit.DIAMONDS: (255, 0, 0),
-            Suit.SPADES: (0, 0, 0),
-            Suit.CLUBS: (0, 0, 0)
-        }[self]
+        return _SUIT_COLOURS[self]
 
     def get_icon(self) -> Surface:
-        return {
-            Suit.HEARTS: SuitsSmall.hearts,
-            Suit.DIAMONDS: SuitsSmall.diamonds,
-            Suit.SPADES: SuitsSmall.spades,
-            Suit.CLUBS: SuitsSmall.clubs
-        }[self]
+        return _SUIT_ICONS[self]
 
 
 class Power(enum.IntEnum):
@@ -79,21 +92,38 @@ class Power(enum.IntEnum):
             return [10]
 
     def get_char(self):
-        return {
-            Power.ACE: 'A',
-            Power.TWO: '2',
-            Power.THREE: '3',
-            Power.FOUR: '4',
-            Power.FIVE: '5',
-            Power.SIX: '6',
-            Power.SEVEN: '7',
-            Power.EIGHT: '8',
-            Power.NINE: '9',
-            Power.TEN: '10',
-            Power.JACK: 'J',
-            Power.QUEEN: 'Q',
-            Power.KING: 'K'
-        }[self]
+        return _POWER_CHARS[self]
+
+
+_SUIT_COLOURS = {
+    Suit.HEARTS: (255, 0, 0),
+    Suit.DIAMONDS: (255, 0, 0),
+    Suit.SPADES: (0, 0, 0),
+    Suit.CLUBS: (0, 0, 0)
+}
+
+_SUIT_ICONS = {
+    Suit.HEARTS: SuitsSmall.hearts,
+    Suit.DIAMONDS: SuitsSmall.diamonds,
+    Suit.SPADES: SuitsSmall.spades,
+    Suit.CLUBS: SuitsSmall.clubs
+}
+
+_POWER_CHARS = {
+    Power.ACE: 'A',
+    Power.TWO: '2',
+    Power.THREE: '3',
+    Power.FOUR: '4',
+    Power.FIVE: '5',
+    Power.SIX: '6',
+    Power.SEVEN: '7',
+    Power.EIGHT: '8',
+    Power.NINE: '9',
+    Power.TEN: '10',
+    Power.JACK: 'J',
+    Power.QUEEN: 'Q',
+    Power.KING: 'K'
+}
 
 
 if __name__ == '__main__':
@@ -1,31 +1,39 @@
 import itertools
-from collections import deque, namedtuple
+import queue
+from functools import partial
 from io import BytesIO
-from typing import Tuple, List
+from typing import Tuple
 
 import requests
 from PIL import Image
 from pygame import *
-from pygame import gfxdraw
 
 from blackjackremote import blackjackcard
+from blackjackremote.backend import BackendClient, get_backend
+from blackjackremote.game_state import GameState, SimpleHandState
 from blackjackremote.hand_state import HandState
-from data.image_half_colour import OCSimpleImage
+from data.image_half_colour import decoded_image_cache
 from data.loader import font_small, font_large, ChipsSmall, shekel
 from virtual_desktop.button import Button
 from virtual_desktop.coin_button import CoinButton
 from virtual_desktop.screensize import ScreenSize
 from virtual_desktop.text_field import TextField
 from virtual_desktop.totp_field import TotpField
-from virtual_desktop.window import Window
-
-BLACKJACK_BACKEND = ("127.0.0.1", 6595)
-SimpleHandState = namedtuple("SimpleHandState", ("hand_state", "bet", "cards"))
+from virtual_desktop.window import Compositor, Window
 
 
 class BlackJackProgram(Window):
-    def __init__(self, window_surface: Surface) -> None:
+    def __init__(self, window_surface: Surface, backend: BackendClient = None) -> None:
         super().__init__(window_surface)
+        self.backend = backend if backend is not None else get_backend()
+        # when set, backend requests run on this executor and on_update is called from it as each reply arrives
+        self.backend_executor = None
+        self.on_update = None
+        self.replies = queue.Queue()
+        self.pending_requests = 0
+        self.refreshing = False
+        # counts moves and logouts so a background poll started before one can't overwrite its result
+        self.move_count = 0
         self.login_button = Button(Rect(self.screen.get_width() // 2 - 42, self.screen.get_height() // 2 + 5, 40, 13),
                                    "Login", (255, 255, 255), (0, 0, 0))
         self.register_button = Button(Rect(self.screen.get_width() // 2 + 2, self.screen.get_height() // 2 + 5, 40, 13),
@@ -63,6 +71,12 @@ class BlackJackProgram(Window):
         self.acknowledge_button = Button(Rect(self.screen.get_width()//2 - 20, self.screen.get_height()-13, 40, 12), "Ok", (100, 255, 100), (255, 255, 255))
         self.play_again_yes_button = Button(Rect(self.screen.get_width()//2 - 42, self.screen.get_height()//2 - 6, 40, 12), "Yes", (90, 255, 90), (255, 255, 255))
         self.play_again_no_button = Button(Rect(self.screen.get_width()//2 + 2, self.screen.get_height()//2 - 6, 40, 12), "No", (255, 90, 90), (255, 255, 255))
+        self.move_buttons = {
+            "hit": Button(Rect(self.screen.get_width()//2 - 63, self.screen.get_height() - 11, 30, 10), "Hit", (0, 255, 0), (0, 0, 0)),
+            "double": Button(Rect(self.screen.get_width()//2 - 31, self.screen.get_height() - 11, 30, 10), "Double", (0, 0, 255), (0, 0, 0)),
+            "stand": Button(Rect(self.screen.get_width()//2 + 1, self.screen.get_height() - 11, 30, 10), "Stand", (255, 0, 0), (0, 0, 0)),
+            "split": Button(Rect(self.screen.get_width()//2 + 33, self.screen.get_height() - 11, 30, 10), "Split", (255, 180, 80), (0, 0, 0))
+        }
         self.exit_button = Button(Rect(self.screen.get_width() - 17, 1, 16, 12), "X", (255,0, 0), (255, 255, 255))
         self.username_field = TextField(84, (255, 255, 255), (255, 255, 255))
         self.totp_field = TotpField(6, (255, 255, 255), (255, 255, 255))
@@ -71,39 +85,30 @@ class BlackJackProgram(Window):
         self.login_error_text = None
         self.registration_qr = None
         self.game_state = None
+        self.rendered_state = None
+        self.compositor = Compositor(self.screen)
+        self.elements = []
+        self.damaged_rects = []
 
     def mouse_click(self, mx, my) -> None:
         super().mouse_click(mx, my)
+        if self.pending_requests:
+            # still waiting on the backend, don't let the player act on a stale screen
+            return
         if self.auth is None:
             if self.username is None:
                 if self.registration_qr is None:
                     if self.login_button.click(mx, my):
                         self.username = self.username_field.get_string()
                     elif self.register_button.click(mx, my):
-                        response = requests.post(f"http://{BLACKJACK_BACKEND[0]}:{BLACKJACK_BACKEND[1]}/auth/register",
-                                                 {"username": self.username_field.get_string()}).text.split("\n")
-                        if response[0] == "failed":
-                            self.login_error_text = response[1]
-                        elif response[0] == "success":
-                            self.registration_qr = response[1]
-                            self.login_error_text = None
+                        self.call_backend(partial(self.backend.register, self.username_field.get_string()), self.on_register_reply)
                 else:
                     if self.scanned_button.click(mx, my):
                         self.registration_qr = None
             else:
                 if self.login_submit_button.click(mx, my) and len(self.totp_field.chars) == self.totp_field.num_digits:
-                    response = requests.post(f"http://{BLACKJACK_BACKEND[0]}:{BLACKJACK_BACKEND[1]}/auth/login",
-                                             {"username": self.username,
-                                              "totp": self.totp_field.get_string()}).text.split('\n')
+                    self.call_backend(partial(self.backend.login, self.username, self.totp_field.get_string()), self.on_login_reply)
                     self.totp_field.clear()
-                    if response[0] == 'failed':
-                        self.login_error_text = response[1]
-                        self.username = None
-                    elif response[0] == 'success':
-                        self.auth = response[1]
-                        response = requests.post(f"http://{BLACKJACK_BACKEND[0]}:{BLACKJACK_BACKEND[1]}/game/blackjack",
-                                                 {"username": self.username, "auth": self.auth, "action": "poll"})
-                        self.game_state = response.text
                 elif self.cancel_totp_button.click(mx, my):
                     self.username = None
                     self.totp_field.clear()
@@ -118,58 +123,118 @@ class BlackJackProgram(Window):
                 for amount, button in itertools.chain(zip(self.get_positive_bets(), self.add_coins),
                                                       zip(self.get_negative_bets(), self.remove_coins)):
                     if button.click(mx, my):
-                        response = requests.post(f"http://{BLACKJACK_BACKEND[0]}:{BLACKJACK_BACKEND[1]}/game/blackjack",
-                                                 {'username': self.username, 'auth': self.auth, "action": "input",
-                                                  "move": amount[1]}).text
-                        if response.split("\n")[0] == "success":
-                            self.game_state = response
+                        self.send_move(amount[1])
 
                 if self.submit_bet_button.click(mx, my):
-                    response = requests.post(f"http://{BLACKJACK_BACKEND[0]}:{BLACKJACK_BACKEND[1]}/game/blackjack",
-                                             {'username': self.username, 'auth': self.auth, "action": "input",
-                                              "move": "submitbet"}).text
-                    if response.split("\n")[0] == "success":
-                        self.game_state = response
+                    self.send_move("submitbet")
             elif game_phase == 'playermove':
                 for button, command, enabled in self.get_move_buttons()[1]:
                     if enabled:
                         if button.click(mx, my):
-                            response = requests.post(f"http://{BLACKJACK_BACKEND[0]}:{BLACKJACK_BACKEND[1]}/game/blackjack",
-                                                     {'username': self.username, 'auth': self.auth, "action": "input",
-                                                      "move": command}).text
-                            if response.split("\n")[0] == "success":
-                                self.game_state = response
+                            self.send_move(command)
             elif game_phase == 'dealermove':
                 if self.acknowledge_button.click(mx, my):
-                    response = requests.post(f"http://{BLACKJACK_BACKEND[0]}:{BLACKJACK_BACKEND[1]}/game/blackjack",
-                                             {'username': self.username, 'auth': self.auth, "action": "input",
-                                              "move": 'ack'}).text
-                    if response.split('\n')[0] == 'success':
-                        self.game_state = response
+                    self.send_move('ack')
 
             elif game_phase == 'payout':
                 if self.acknowledge_button.click(mx, my):
-                    response = requests.post(f"http://{BLACKJACK_BACKEND[0]}:{BLACKJACK_BACKEND[1]}/game/blackjack",
-                                             {'username': self.username, 'auth': self.auth, "action": "input",
-                                              "move": 'ack'}).text
-                    if response.split('\n')[0] == 'success':
-                        self.game_state = response
+                    self.send_move('ack')
             elif game_phase == 'continueplaying':
                 if self.play_again_yes_button.click(mx, my):
-                    response = requests.post(f"http://{BLACKJACK_BACKEND[0]}:{BLACKJACK_BACKEND[1]}/game/blackjack",
-                                             {'username': self.username, 'auth': self.auth, "action": "input",
-                                              "move": 'yes'}).text
-                    if response.split('\n')[0] == 'success':
-                        self.game_state = response
+                    self.send_move('yes')
                 elif self.play_again_no_button.click(mx, my):
-                    response = requests.post(f"http://{BLACKJACK_BACKEND[0]}:{BLACKJACK_BACKEND[1]}/game/blackjack",
-                                             {'username': self.username, 'auth': self.auth, "action": "input",
-                                              "move": 'no'}).text
-                    if response.split('\n')[0] == 'success':
-                        if response.split('\n')[1] == 'GAME OVER':
-                            self.reset()
+                    self.move_count += 1
+                    self.call_backend(partial(self.backend.input, self.username, self.auth, 'no'), self.on_play_again_no_reply)
+
+    def call_backend(self, request, on_reply, background=False) -> None:
+        """
+        Runs a backend request and hands its reply text to on_reply. Without a backend_executor this happens right away,
+        otherwise the request runs in the background and its reply is handled by the next apply_replies
+        :param request: Callable making the request
+        :param on_reply: Callable taking the reply
+        :param background: Whether the player didn't ask for this, so it shouldn't show as pending
+        """
+        if self.backend_executor is None:
+            try:
+                response = request()
+            except requests.RequestException as e:
+                # keep showing the last state, the player can try again
+                print(f"backend request failed: {e}")
+                return
+            on_reply(response)
+            return
+        if background:
+            self.refreshing = True
+        else:
+            self.pending_requests += 1
+        self.backend_executor.submit(request).add_done_callback(lambda future: self.reply_arrived(future, on_reply, background))
+
+    def reply_arrived(self, future, on_reply, background) -> None:
+        # runs on the executor's thread, the reply is only applied on the session's own thread
+        self.replies.put((future, on_reply, background))
+        if self.on_update is not None:
+            self.on_update()
+
+    def apply_replies(self) -> bool:
+        """
+        Handles every backend reply that has arrived since the last call
+        :return: Whether any reply was handled
+        """
+        applied = False
+        while True:
+            try:
+                future, on_reply, background = self.replies.get_nowait()
+            except queue.Empty:
+                return applied
+            if background:
+                self.refreshing = False
+            else:
+                self.pending_requests -= 1
+            applied = True
+            try:
+                response = future.result()
+            except requests.RequestException as e:
+                # keep showing the last state, the next refresh or click tries the backend again
+                print(f"backend request failed: {e}")
+                continue
+            on_reply(response)
+
+    def send_move(self, move: str) -> None:
+        self.move_count += 1
+        self.call_backend(partial(self.backend.input, self.username, self.auth, move), self.on_move_reply)
+
+    def on_move_reply(self, response: str) -> None:
+        if response.split("\n")[0] == "success":
+            self.game_state = GameState.parse(response)
+
+    def on_register_reply(self, response: str) -> None:
+        response = response.split("\n")
+        if response[0] == "failed":
+            self.login_error_text = response[1]
+        elif response[0] == "success":
+            self.registration_qr = response[1]
+            self.login_error_text = None
+
+    def on_login_reply(self, response: str) -> None:
+        response = response.split('\n')
+        if response[0] == 'failed':
+            self.login_error_text = response[1]
+            self.username = None
+        elif response[0] == 'success':
+            # stay on the login screen until there is a game state to show
+            self.call_backend(partial(self.backend.poll, self.username, response[1]), partial(self.on_first_poll_reply, response[1]))
+
+    def on_first_poll_reply(self, auth: str, response: str) -> None:
+        self.auth = auth
+        self.game_state = GameState.parse(response)
+
+    def on_play_again_no_reply(self, response: str) -> None:
+        if response.split('\n')[0] == 'success':
+            if response.split('\n')[1] == 'GAME OVER':
+                self.reset()
 
     def reset(self):
+        self.move_count += 1
         self.auth = None
         self.username = None
         self.registration_qr = None
@@ -179,15 +244,30 @@ class BlackJackProgram(Window):
         self.username_field.clear()
 
     def get_current_game_state(self):
-        response = requests.post(f"http://{BLACKJACK_BACKEND[0]}:{BLACKJACK_BACKEND[1]}/game/blackjack",
-                                 {"username": self.username, "auth": self.auth, "action": "poll"}).text
+        self.apply_polled_state(self.backend.poll(self.username, self.auth))
+
+    def refresh_game_state(self) -> bool:
+        """
+        Polls the backend in the background. Skipped while the player is waiting on a request or a refresh is
+        already out, so refreshes never pile up
+        :return: Whether a poll was started
+        """
+        if self.auth is None or self.backend_executor is None or self.pending_requests or self.refreshing:
+            return False
+        self.call_backend(partial(self.backend.poll, self.username, self.auth),
+                          partial(self.on_refresh_reply, self.move_count), background=True)
+        return True
+
+    def on_refresh_reply(self, move_count: int, response: str) -> None:
+        if move_count == self.move_count and self.auth is not None:
+            self.apply_polled_state(response)
+
+    def apply_polled_state(self, response: str) -> None:
         split_response = response.split("\n")
         response_success = split_response[0]
-        if response_success == "success":
-            self.game_state = response
-        else:
+        if response_success != "success":
             self.auth = None
-        self.game_state = response
+        self.game_state = GameState.parse(response)
 
     def key_input(self, keycode, mod) -> None:
         super().key_input(keycode, mod)
@@ -217,76 +297,100 @@ class BlackJackProgram(Window):
                 else:
                     self.totp_field.add_char(keycode, mod)
 
+    def get_state_key(self):
+        return (self.username, self.auth, self.login_error_text, self.registration_qr, self.game_state, self.pending_requests > 0,
+                tuple(self.username_field.chars), self.username_field.cursor_pos,
+                tuple(self.totp_field.chars), self.totp_field.cursor_pos)
+
+    def is_dirty(self) -> bool:
+        return self.get_state_key() != self.rendered_state
+
     def render(self) -> None:
         super().render()
+        self.rendered_state = self.get_state_key()
+        self.elements = []
+        screen_key, draw_static = self.layout()
+        if self.pending_requests:
+            self.place_pending()
+        self.damaged_rects = self.compositor.compose(screen_key, draw_static, self.elements)
+
+    def get_damaged_rects(self):
+        return self.damaged_rects
+
+    def place(self, surface: Surface, pos, key=None) -> None:
+        """
+        Adds a dynamic element to the frame being rendered
+        :param surface: What to draw
+        :param pos: Where to draw it
+        :param key: Identifies the surface's content, surfaces that are cached and reused can leave this out
+        """
+        self.elements.append((surface if key is None else key, surface, pos))
+
+    def place_button(self, button: Button) -> None:
+        self.place(button.render(), button.pos.topleft)
+
+    def place_text(self, text: str, font, colour, pos_for_size) -> Surface:
+        rendered_text = font.render(text, False, colour)
+        self.place(rendered_text, pos_for_size(rendered_text), ("text", text, id(font), colour))
+        return rendered_text
+
+    def layout(self):
+        """
+        Places the dynamic elements of the current screen
+        :return: The screen's key and a function drawing its static layer
+        """
+        width = self.screen.get_width()
+        height = self.screen.get_height()
         if self.auth is None:
             if self.username is None:
                 # still have to select login or register
-                self.screen.fill((0, 0, 0))
                 if self.registration_qr is None:
-                    self.screen.blit(self.login_button.render(), self.login_button.pos)
-                    self.screen.blit(self.register_button.render(), self.register_button.pos)
-
                     rendered_username_prompt = self.username_field.render(ScreenSize.SMALL)
-
-                    render_prompt = font_small.render("Login/Register", False, (255, 255, 255))
-                    self.screen.blit(render_prompt, (self.screen.get_width() // 2 - render_prompt.get_width() // 2,
-                                                     self.screen.get_height() // 2 - render_prompt.get_height() - rendered_username_prompt.get_height()))
-                    self.screen.blit(rendered_username_prompt, (
-                        self.screen.get_width() // 2 - rendered_username_prompt.get_width() // 2,
-                        self.screen.get_height() // 2 - rendered_username_prompt.get_height()))
+                    self.place(rendered_username_prompt, (width // 2 - rendered_username_prompt.get_width() // 2,
+                                                          height // 2 - rendered_username_prompt.get_height()),
+                               ("username", tuple(self.username_field.chars), self.username_field.cursor_pos))
                     if self.login_error_text:
-                        rendered_reason = font_small.render(self.login_error_text, False, (255, 0, 0))
-                        self.screen.blit(rendered_reason, (
-                            self.screen.get_width() // 2 - rendered_reason.get_width() // 2,
-                            self.screen.get_height() - rendered_reason.get_height() - 1))
+                        self.place_text(self.login_error_text, font_small, (255, 0, 0),
+                                        lambda rendered: (width // 2 - rendered.get_width() // 2, height - rendered.get_height() - 1))
+                    return "login", self.draw_login_static
                 else:
-                    registration_qr = OCSimpleImage().deserialize(self.registration_qr, 2).get_surface()
-                    draw.rect(self.screen, (255, 255, 255), (
-                        self.screen.get_width() // 2 - registration_qr.get_width() // 2, 0, registration_qr.get_width(),
-                        self.screen.get_height()))
-                    self.screen.blit(registration_qr,
-                                     (self.screen.get_width() // 2 - registration_qr.get_width() // 2, 0))
-
-                    self.screen.blit(self.scanned_button.render(), self.scanned_button.pos)
+                    registration_qr = decoded_image_cache.get_surface(self.registration_qr, 2)
+                    qr_background = Surface((registration_qr.get_width(), height))
+                    qr_background.fill((255, 255, 255))
+                    self.place(qr_background, (width // 2 - registration_qr.get_width() // 2, 0), ("qr_background", qr_background.get_size()))
+                    self.place(registration_qr, (width // 2 - registration_qr.get_width() // 2, 0))
+                    self.place_button(self.scanned_button)
                     # rendered_qr_label = font_mono_light.render(f"Use a 2FA app", False, (0, 0, 0))
                     # self.screen.blit(rendered_qr_label, (self.screen.get_width()//2 - rendered_qr_label.get_width()//2, self.screen.get_height() - rendered_qr_label.get_height() - 1))
+                    return "registration", self.draw_black_static
             else:
-                self.screen.fill((0, 0, 0))
                 rendered_totp_field = self.totp_field.render(ScreenSize.SMALL)
-                self.screen.blit(rendered_totp_field, (
-                    self.screen.get_width() // 2 - rendered_totp_field.get_width() // 2,
-                    self.screen.get_height() // 2 - rendered_totp_field.get_height() // 2))
-                prompt_text = font_small.render(f"Enter the TOTP for {self.username}", False, (255, 255, 255))
-                self.screen.blit(prompt_text, (self.screen.get_width() // 2 - prompt_text.get_width() // 2,
-                                               self.screen.get_height() // 2 - rendered_totp_field.get_height() // 2 - prompt_text.get_height() - 1))
-                self.screen.blit(self.login_submit_button.render(), self.login_submit_button.pos)
-                self.screen.blit(self.cancel_totp_button.render(), self.cancel_totp_button.pos)
+                self.place(rendered_totp_field, (width // 2 - rendered_totp_field.get_width() // 2,
+                                                 height // 2 - rendered_totp_field.get_height() // 2),
+                           ("totp", tuple(self.totp_field.chars), self.totp_field.cursor_pos))
+                self.place_text(f"Enter the TOTP for {self.username}", font_small, (255, 255, 255),
+                                lambda rendered: (width // 2 - rendered.get_width() // 2,
+                                                  height // 2 - rendered_totp_field.get_height() // 2 - rendered.get_height() - 1))
+                return "totp", self.draw_totp_static
         else:
-            self.screen.fill((0, 120, 0))
-            game_data = self.game_state.split("\n")
+            screen_key = "game"
+            draw_static = self.draw_table_static
             game_phase = self.get_game_phase()
             if game_phase != "GAME":
                 bets = self.get_bets()
                 if bets:
-                    rendered_bet = font_small.render(f"Bets:", False, (255, 255, 255))
-                    self.screen.blit(rendered_bet, (1, 1))
+                    rendered_bet = self.place_text(f"Bets:", font_small, (255, 255, 255), lambda rendered: (1, 1))
                     y_height = 1 + rendered_bet.get_height()
                     for i, bet in enumerate(bets):
-                        rendered_bet = font_small.render(f"Hand {i+1}: {bet}", False, (255, 255, 255))
-                        self.screen.blit(rendered_bet, (1, y_height))
+                        rendered_bet = self.place_text(f"Hand {i+1}: {bet}", font_small, (255, 255, 255), lambda rendered: (1, y_height))
                         y_height += rendered_bet.get_height()
             if game_phase == "betting":
-                bet_amount = int(game_data[1].split(" ")[1])
-                moves = game_data[2].strip().split(" ")
-                num_bet_options = moves[1]
-                bet_options = moves[2:]
-                bet_text = font_small.render("Place a bet!", False, (255, 255, 255))
-                self.screen.blit(bet_text, (self.screen.get_width() // 2 - bet_text.get_width() // 2, 5))
-
-                bet_amount_text = font_large.render(str(bet_amount), False, (255, 255, 255))
-                self.screen.blit(bet_amount_text, (
-                    self.screen.get_width() // 2 - bet_amount_text.get_width() // 2, 6 + bet_text.get_height()))
+                screen_key, draw_static = "betting", self.draw_betting_static
+                bet_amount = self.game_state.bet_amount
+                bet_options = list(self.game_state.bet_options)
+                bet_text_height = font_small.size("Place a bet!")[1]
+                self.place_text(str(bet_amount), font_large, (255, 255, 255),
+                                lambda rendered: (width // 2 - rendered.get_width() // 2, 6 + bet_text_height))
                 if bet_options != ['0']:
                     if 'submitbet' in bet_options:
                         self.submit_bet_button.background_colour = (255, 255, 255)
@@ -294,19 +398,20 @@ class BlackJackProgram(Window):
                     else:
                         self.submit_bet_button.background_colour = (150, 150, 150)
                         self.submit_bet_button.text_colour = (180, 180, 180)
-                    self.screen.blit(self.submit_bet_button.render(), self.submit_bet_button.pos)
+                    self.place_button(self.submit_bet_button)
                     for amount, button in zip(self.get_positive_bets(), self.add_coins):
                         button.label = f"+{amount[0]}"
-                        self.screen.blit(button.render(), button.pos)
+                        self.place_button(button)
 
                     for amount, button in zip(self.get_negative_bets(), self.remove_coins):
                         button.label = amount[0]
-                        self.screen.blit(button.render(), button.pos)
+                        self.place_button(button)
                 else:
                     print("Not enough funds")
             elif game_phase == 'playermove':
+                screen_key, draw_static = "playermove", self.draw_playermove_static
                 num_active_hands, hands = self.get_player_hands()
-                hand_offset_x = self.screen.get_width() // (num_active_hands + 1)
+                hand_offset_x = width // (num_active_hands + 1)
                 active_hand, move_buttons = self.get_move_buttons()
                 for i, hand in enumerate(hands):
                     hand_center = hand_offset_x * (i + 1)
@@ -318,81 +423,63 @@ class BlackJackProgram(Window):
                             rendered_card = blackjackcard.render(card, ScreenSize.SMALL)
                             card_offset_x = int(-len(hand.cards) / 2 * rendered_card.get_width() + (
                                     rendered_card.get_width() + 1) * j)
-                            self.screen.blit(rendered_card, (hand_center + card_offset_x,
-                                                             self.screen.get_height() // 2 - rendered_card.get_height() // 2 + 23))
+                            self.place(rendered_card, (hand_center + card_offset_x,
+                                                       height // 2 - rendered_card.get_height() // 2 + 23))
                             min_hand_x = min(min_hand_x, card_offset_x)
                             max_hand_x = max(max_hand_x, card_offset_x + rendered_card.get_width())
                             card_height = rendered_card.get_height()
                         if not (hand.hand_state & HandState.STANDING) and i == active_hand:
-                            draw.rect(self.screen, (100, 100, 255), (hand_center + min_hand_x - 2, self.screen.get_height()//2 - card_height//2 + 21, max_hand_x - min_hand_x + 4, 20), 1)
-                self.draw_dealer_hand()
+                            self.place_outline((100, 100, 255), (hand_center + min_hand_x - 2, height//2 - card_height//2 + 21, max_hand_x - min_hand_x + 4, 20))
+                self.place_dealer_hand()
 
                 for button, command, button_enabled in move_buttons:
-                    self.screen.blit(button.render(), button.pos)
-
-                current_game_phase_render = font_small.render("Your Move", False, (255, 255, 255))
-                self.screen.blit(current_game_phase_render, (self.screen.get_width()//2 - current_game_phase_render.get_width()//2, 1))
+                    self.place_button(button)
             elif game_phase == 'dealermove':
-                self.basic_draw_game()
-
-                self.screen.blit(self.acknowledge_button.render(), self.acknowledge_button.pos)
-
-                current_game_phase_render = font_small.render("Dealer's Move", False, (255, 255, 255))
-                self.screen.blit(current_game_phase_render, (self.screen.get_width()//2 - current_game_phase_render.get_width()//2, 1))
+                screen_key, draw_static = "dealermove", self.draw_dealermove_static
+                self.place_game()
             elif game_phase == 'payout':
-
-                game_result = self.game_state.split("\n")[2].split(" ")
+                game_result = (self.game_state.result, self.game_state.winnings)
+                screen_key, draw_static = ("payout", game_result[0]), partial(self.draw_payout_static, game_result[0])
                 if game_result[0] == 'won':
-                    self.screen.fill((50, 210, 235))
-                    self.screen.blit(self.acknowledge_button.render(), self.acknowledge_button.pos)
-
-                    current_game_phase_render = font_small.render("Payout", False, (255, 255, 255))
-                    self.screen.blit(current_game_phase_render, (self.screen.get_width()//2 - current_game_phase_render.get_width()//2, 1))
-
-                    victory_text = font_large.render("You Won!", False, (255, 255, 255))
-                    self.screen.blit(victory_text, (self.screen.get_width()//2 - victory_text.get_width()//2, 5 + current_game_phase_render.get_height()))
-
-                    winnings_amount = font_large.render(game_result[1], False, (255, 255, 255))
-                    self.screen.blit(winnings_amount, (self.screen.get_width()//2 - winnings_amount.get_width()//2, victory_text.get_height() + current_game_phase_render.get_height()))
-                    self.screen.blit(shekel, (self.screen.get_width()//2 + winnings_amount.get_width()//2 + 2, 8 + victory_text.get_height() + current_game_phase_render.get_height()))
-                elif game_result[0] == 'tie':
-                    self.screen.fill((150, 150, 150))
-                    self.screen.blit(self.acknowledge_button.render(), self.acknowledge_button.pos)
-
-                    current_game_phase_render = font_small.render("Payout", False, (255, 255, 255))
-                    self.screen.blit(current_game_phase_render, (self.screen.get_width()//2 - current_game_phase_render.get_width()//2, 1))
-
-                    victory_text = font_large.render("Tie", False, (255, 255, 255))
-                    self.screen.blit(victory_text, (self.screen.get_width()//2 - victory_text.get_width()//2, 5 + current_game_phase_render.get_height()))
-                elif game_result[0] == 'loss':
-                    self.screen.fill((150, 100, 100))
-                    self.screen.blit(self.acknowledge_button.render(), self.acknowledge_button.pos)
-
-                    current_game_phase_render = font_small.render("Payout", False, (255, 255, 255))
-                    self.screen.blit(current_game_phase_render, (self.screen.get_width()//2 - current_game_phase_render.get_width()//2, 1))
-
-                    victory_text = font_large.render("You Lose", False, (255, 255, 255))
-                    self.screen.blit(victory_text, (self.screen.get_width()//2 - victory_text.get_width()//2, 5 + current_game_phase_render.get_height()))
+                    title_height = font_small.size("Payout")[1]
+                    victory_height = font_large.size("You Won!")[1]
+                    rendered_winnings = self.place_text(game_result[1], font_large, (255, 255, 255),
+                                                        lambda rendered: (width//2 - rendered.get_width()//2, victory_height + title_height))
+                    self.place(shekel, (width//2 + rendered_winnings.get_width()//2 + 2, 8 + victory_height + title_height))
             elif game_phase == 'continueplaying':
-                self.basic_draw_game()
-                gfxdraw.box(self.screen, (10, 10, self.screen.get_width() - 20 , self.screen.get_height() - 20), (0, 0, 0, 220))
-
-                play_again_prompt = font_small.render("Play Again?", False, (255, 255, 255))
-                self.screen.blit(play_again_prompt, (self.screen.get_width()//2 - play_again_prompt.get_width()//2, 22))
-                self.screen.blit(self.play_again_yes_button.render(), self.play_again_yes_button.pos)
-                self.screen.blit(self.play_again_no_button.render(), self.play_again_no_button.pos)
-            self.screen.blit(self.exit_button.render(), self.exit_button.pos)
-
-    def draw_dealer_hand(self):
+                self.place_game()
+                overlay = Surface((width - 20, height - 20), SRCALPHA)
+                overlay.fill((0, 0, 0, 220))
+                self.place(overlay, (10, 10), ("overlay", overlay.get_size()))
+
+                self.place_text("Play Again?", font_small, (255, 255, 255), lambda rendered: (width//2 - rendered.get_width()//2, 22))
+                self.place_button(self.play_again_yes_button)
+                self.place_button(self.play_again_no_button)
+            self.place_button(self.exit_button)
+            return screen_key, draw_static
+
+    def place_outline(self, colour, rect) -> None:
+        outline = Surface(Rect(rect).size)
+        outline.set_colorkey((0, 0, 0))
+        draw.rect(outline, colour, outline.get_rect(), 1)
+        self.place(outline, Rect(rect).topleft, ("outline", colour, outline.get_size()))
+
+    def place_pending(self) -> None:
+        rendered_pending = font_small.render("...", False, (255, 255, 255))
+        pending = Surface((rendered_pending.get_width() + 2, rendered_pending.get_height() + 2))
+        pending.blit(rendered_pending, (1, 1))
+        self.place(pending, (0, self.screen.get_height() - rendered_pending.get_height() - 2), "pending")
+
+    def place_dealer_hand(self):
         dealer_hand = self.get_dealer_hand().cards
         for i, card in enumerate(dealer_hand):
             rendered_card = blackjackcard.render(card, ScreenSize.SMALL)
             card_offset_x = int(-len(dealer_hand) / 2 * rendered_card.get_width() + (
                     rendered_card.get_width() + 1) * i)
-            self.screen.blit(rendered_card, (self.screen.get_width() // 2 + card_offset_x,
-                                             self.screen.get_height() // 2 - rendered_card.get_height() // 2 - 23))
+            self.place(rendered_card, (self.screen.get_width() // 2 + card_offset_x,
+                                       self.screen.get_height() // 2 - rendered_card.get_height() // 2 - 23))
 
-    def basic_draw_game(self):
+    def place_game(self):
         num_active_hands, hands = self.get_player_hands()
         hand_offset_x = self.screen.get_width() // (num_active_hands + 1)
         for i, hand in enumerate(hands):
@@ -402,79 +489,96 @@ class BlackJackProgram(Window):
                     rendered_card = blackjackcard.render(card, ScreenSize.SMALL)
                     card_offset_x = int(-len(hand.cards) / 2 * rendered_card.get_width() + (
                             rendered_card.get_width() + 1) * j)
-                    self.screen.blit(rendered_card, (hand_center + card_offset_x,
-                                                     self.screen.get_height() // 2 - rendered_card.get_height() // 2 + 23))
-
-        self.draw_dealer_hand()
+                    self.place(rendered_card, (hand_center + card_offset_x,
+                                               self.screen.get_height() // 2 - rendered_card.get_height() // 2 + 23))
+
+        self.place_dealer_hand()
+
+    def draw_black_static(self, surface: Surface) -> None:
+        surface.fill((0, 0, 0))
+
+    def draw_login_static(self, surface: Surface) -> None:
+        surface.fill((0, 0, 0))
+        surface.blit(self.login_button.render(), self.login_button.pos)
+        surface.blit(self.register_button.render(), self.register_button.pos)
+        field_height = self.username_field.render(ScreenSize.SMALL).get_height()
+        render_prompt = font_small.render("Login/Register", False, (255, 255, 255))
+        surface.blit(render_prompt, (surface.get_width() // 2 - render_prompt.get_width() // 2,
+                                     surface.get_height() // 2 - render_prompt.get_height() - field_height))
+
+    def draw_totp_static(self, surface: Surface) -> None:
+        surface.fill((0, 0, 0))
+        surface.blit(self.login_submit_button.render(), self.login_submit_button.pos)
+        surface.blit(self.cancel_totp_button.render(), self.cancel_totp_button.pos)
+
+    def draw_table_static(self, surface: Surface) -> None:
+        surface.fill((0, 120, 0))
+
+    def draw_betting_static(self, surface: Surface) -> None:
+        surface.fill((0, 120, 0))
+        bet_text = font_small.render("Place a bet!", False, (255, 255, 255))
+        surface.blit(bet_text, (surface.get_width() // 2 - bet_text.get_width() // 2, 5))
+
+    def draw_playermove_static(self, surface: Surface) -> None:
+        surface.fill((0, 120, 0))
+        current_game_phase_render = font_small.render("Your Move", False, (255, 255, 255))
+        surface.blit(current_game_phase_render, (surface.get_width()//2 - current_game_phase_render.get_width()//2, 1))
+
+    def draw_dealermove_static(self, surface: Surface) -> None:
+        surface.fill((0, 120, 0))
+        surface.blit(self.acknowledge_button.render(), self.acknowledge_button.pos)
+        current_game_phase_render = font_small.render("Dealer's Move", False, (255, 255, 255))
+        surface.blit(current_game_phase_render, (surface.get_width()//2 - current_game_phase_render.get_width()//2, 1))
+
+    def draw_payout_static(self, result: str, surface: Surface) -> None:
+        backgrounds = {'won': (50, 210, 235), 'tie': (150, 150, 150), 'loss': (150, 100, 100)}
+        titles = {'won': "You Won!", 'tie': "Tie", 'loss': "You Lose"}
+        if result not in backgrounds:
+            surface.fill((0, 120, 0))
+            return
+        surface.fill(backgrounds[result])
+        surface.blit(self.acknowledge_button.render(), self.acknowledge_button.pos)
+
+        current_game_phase_render = font_small.render("Payout", False, (255, 255, 255))
+        surface.blit(current_game_phase_render, (surface.get_width()//2 - current_game_phase_render.get_width()//2, 1))
+
+        victory_text = font_large.render(titles[result], False, (255, 255, 255))
+        surface.blit(victory_text, (surface.get_width()//2 - victory_text.get_width()//2, 5 + current_game_phase_render.get_height()))
 
     def get_positive_bets(self):
-        moves_line = self.game_state.split("\n")[2].split(" ")
-        num_moves = moves_line[1]
-        moves = moves_line[2:]
-        return [(move[3:], move) for move in moves if move[0:3] == "bet" and move[3] != '-']
+        return self.game_state.positive_bets
 
     def get_negative_bets(self):
-        moves_line = self.game_state.split("\n")[2].split(" ")
-        num_moves = moves_line[1]
-        moves = moves_line[2:]
-        return [(move[3:], move) for move in moves if move[0:3] == "bet" and move[3] == '-']
-
-    def get_player_hands(self) -> Tuple[int, List[SimpleHandState]]:
-        hand_data = self.game_state.split("\n")[2].split(" ")
-        num_hands = int(hand_data[1])
-        hand_stack = deque(hand_data[2:])  # TODO: replace deque with pointer and move pointer instead of pop from deque
-        hands_out = []
-        num_active = 0
-        for i in range(num_hands):
-            hand_state = HandState(int(hand_stack.popleft()))
-            if hand_state & HandState.ACTIVE:
-                num_active += 1
-            hand_bet = int(hand_stack.popleft())
-            num_cards = int(hand_stack.popleft())
-            cards = [int(hand_stack.popleft()) for _ in range(num_cards)]
-            hands_out.append(SimpleHandState(hand_state, hand_bet, cards))
-        return num_active, hands_out
+        return self.game_state.negative_bets
+
+    def get_player_hands(self) -> Tuple[int, Tuple[SimpleHandState, ...]]:
+        return self.game_state.num_active_hands, self.game_state.player_hands
 
     def get_dealer_hand(self) -> SimpleHandState:
-        hand_data = self.game_state.split("\n")[3].split(" ")
-        num_cards = int(hand_data[1])
-        cards = [int(i) for i in hand_data[2:]]
-        return SimpleHandState(HandState.ACTIVE, 0, cards)
+        return self.game_state.dealer_hand
 
     def get_game_phase(self):
-        game_data = self.game_state.split("\n")
-        return game_data[1].split(" ")[0]
+        return self.game_state.phase
 
-    def get_move_buttons(self):
-        num_active_hands = self.get_player_hands()[0]
-        buttons = {
-            "hit": Button(Rect(self.screen.get_width()//2 - 63, self.screen.get_height() - 11, 30, 10), "Hit", (0, 255, 0), (0, 0, 0)),
-            "double": Button(Rect(self.screen.get_width()//2 - 31, self.screen.get_height() - 11, 30, 10), "Double", (0, 0, 255), (0, 0, 0)),
-            "stand": Button(Rect(self.screen.get_width()//2 + 1, self.screen.get_height() - 11, 30, 10), "Stand", (255, 0, 0), (0, 0, 0)),
-            "split": Button(Rect(self.screen.get_width()//2 + 33, self.screen.get_height() - 11, 30, 10), "Split", (255, 180, 80), (0, 0, 0))
-        }
+    def get_screen_name(self) -> str:
+        """
+        Names the screen the player is on, the game phase once logged in
+        """
+        if self.auth is None:
+            if self.username is None:
+                return "login" if self.registration_qr is None else "registration"
+            return "totp"
+        return str(self.game_state.phase) if self.game_state is not None else "loading"
 
-        active_hand = None
-        possible_moves = self.game_state.split("\n")[4].strip().split(" ")[2:]
-        for move in possible_moves:
-            move_hand = int(move[-1])
-            if active_hand is not None:
-                assert active_hand == move_hand
-            else:
-                active_hand = move_hand
-        enabled = set()
-        for move in possible_moves:
-            buttons[move[:-2]].text_colour = (255, 255, 255)
-            enabled.add(move[:-2])
-        return active_hand, ((buttons['hit'], f"hit_{active_hand}", 'hit' in enabled), (buttons['double'], f"double_{active_hand}", 'double' in enabled), (buttons['stand'], f"stand_{active_hand}", 'stand' in enabled), (buttons['split'], f"split_{active_hand}", 'split' in enabled))
+    def get_move_buttons(self):
+        active_hand = self.game_state.active_hand
+        enabled = self.game_state.enabled_moves
+        for move, button in self.move_buttons.items():
+            button.text_colour = (255, 255, 255) if move in enabled else (0, 0, 0)
+        return active_hand, tuple((self.move_buttons[move], f"{move}_{active_hand}", move in enabled) for move in ("hit", "double", "stand", "split"))
 
     def get_bets(self):
-        game_phase = self.get_game_phase()
-        if game_phase == 'continueplaying' or game_phase == 'betting' or game_phase == 'payout':
-            return None
-        else:
-            player_hand_info = self.get_player_hands()
-            return [hand.bet * (2 if hand.hand_state & HandState.DOUBLING else 1) for hand in player_hand_info[1] if hand.bet > 0]
+        return self.game_state.bets
 
     def log_out(self):
         self.username = None
@@ -0,0 +1,86 @@
+from collections import namedtuple
+
+from blackjackremote.hand_state import HandState
+
+SimpleHandState = namedtuple("SimpleHandState", ("hand_state", "bet", "cards"))
+
+# phases where the third line of the reply holds the player's hands and the fourth the dealer's
+HAND_PHASES = ("playermove", "dealermove", "continueplaying")
+
+
+class GameState(namedtuple("GameState", ("raw", "phase", "bet_amount", "bet_options", "positive_bets",
+                                         "negative_bets", "num_active_hands", "player_hands", "dealer_hand",
+                                         "active_hand", "enabled_moves", "bets", "result", "winnings"))):
+    """
+    A reply from the blackjack backend, parsed once when it arrives
+    """
+    __slots__ = ()
+
+    @staticmethod
+    def parse(raw: str) -> "GameState":
+        game_data = raw.split("\n")
+        phase_line = game_data[1].split(" ") if len(game_data) > 1 else [None]
+        phase = phase_line[0] if game_data[0] == "success" else None
+
+        bet_amount = None
+        bet_options = ()
+        positive_bets = ()
+        negative_bets = ()
+        if phase == "betting":
+            bet_amount = int(phase_line[1])
+            bet_options = tuple(game_data[2].strip().split(" ")[2:])
+            positive_bets = tuple((move[3:], move) for move in bet_options if move[0:3] == "bet" and move[3] != '-')
+            negative_bets = tuple((move[3:], move) for move in bet_options if move[0:3] == "bet" and move[3] == '-')
+
+        num_active_hands = 0
+        player_hands = ()
+        dealer_hand = None
+        if phase in HAND_PHASES:
+            num_active_hands, player_hands = GameState._parse_player_hands(game_data[2])
+            dealer_hand = SimpleHandState(HandState.ACTIVE, 0, tuple(int(i) for i in game_data[3].strip().split(" ")[2:]))
+
+        active_hand = None
+        enabled_moves = frozenset()
+        if phase == "playermove":
+            possible_moves = game_data[4].strip().split(" ")[2:]
+            for move in possible_moves:
+                move_hand = int(move[-1])
+                if active_hand is not None:
+                    assert active_hand == move_hand
+                else:
+                    active_hand = move_hand
+            enabled_moves = frozenset(move[:-2] for move in possible_moves)
+
+        bets = None
+        if phase in HAND_PHASES and phase != "continueplaying":
+            bets = tuple(hand.bet * (2 if hand.hand_state & HandState.DOUBLING else 1) for hand in player_hands if hand.bet > 0)
+
+        result = None
+        winnings = None
+        if phase == "payout":
+            game_result = game_data[2].split(" ")
+            result = game_result[0]
+            winnings = game_result[1] if len(game_result) > 1 else None
+
+        return GameState(raw, phase, bet_amount, bet_options, positive_bets, negative_bets, num_active_hands,
+                         player_hands, dealer_hand, active_hand, enabled_moves, bets, result, winnings)
+
+    @staticmethod
+    def _parse_player_hands(hands_line: str):
+        hand_data = hands_line.strip().split(" ")
+        num_hands = int(hand_data[1])
+        position = 2
+        hands_out = []
+        num_active = 0
+        for i in range(num_hands):
+            hand_state = HandState(int(hand_data[position]))
+            if hand_state & HandState.ACTIVE:
+                num_active += 1
+            hand_bet = int(hand_data[position + 1])
+            num_cards = int(hand_data[position + 2])
+            position += 3
+            cards = tuple(int(card) for card in hand_data[position:position + num_cards])
+            position += num_cards
+            hands_out.append(SimpleHandState(hand_state, hand_bet, cards))
+        return num_active, tuple(hands_out)
+
@@ -0,0 +1,157 @@
+import bisect
+import multiprocessing
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# upper bounds in seconds, the last bucket catches everything slower
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+STAGES = {
+    "input_read": "Receiving and splitting input lines, fork server only",
+    "backend": "Blackjack backend HTTP requests",
+    "render": "BlackJackProgram.render",
+    "encode": "Encoding the rendered surface into a frame",
+    "write": "Handing frames to the client socket",
+}
+BACKEND_ACTIONS = ("register", "login", "poll", "input")
+COUNTERS = {
+    "sessions_total": "Sessions opened",
+    "frames_sent_total": "Frames written to clients",
+    "frames_dropped_total": "Frames replaced by a keyframe before a slow client received them",
+    "bytes_sent_total": "Frame bytes written to clients",
+    "inputs_total": "Input lines handled",
+}
+GAUGES = {
+    "sessions_active": "Sessions currently connected",
+}
+METRIC_PREFIX = "blackjackvm_"
+
+
+class Metrics:
+    """
+    Stage timing histograms and session counters kept in shared memory, so sessions in forked children add to the
+    same numbers the parent serves. Must be created before the server forks
+    """
+
+    def __init__(self) -> None:
+        self.series = [("input_read", None), ("render", None), ("encode", None), ("write", None)]
+        self.series += [("backend", action) for action in BACKEND_ACTIONS]
+        # each histogram series is a count per bucket, then the sum of observations
+        self.series_size = len(BUCKETS) + 2
+        self.values_offset = len(self.series) * self.series_size
+        self.value_names = list(COUNTERS) + list(GAUGES)
+        self.values = multiprocessing.RawArray("d", self.values_offset + len(self.value_names))
+        self.lock = multiprocessing.Lock()
+
+    def observe(self, stage: str, seconds: float, action: str = None) -> None:
+        try:
+            start = self.series.index((stage, action)) * self.series_size
+        except ValueError:
+            # an action the histograms weren't made for, e.g. a backend path added later
+            return
+        with self.lock:
+            self.values[start + bisect.bisect_left(BUCKETS, seconds)] += 1
+            self.values[start + self.series_size - 1] += seconds
+
+    def add(self, name: str, amount: float = 1) -> None:
+        index = self.values_offset + self.value_names.index(name)
+        with self.lock:
+            self.values[index] += amount
+
+    def exposition(self) -> str:
+        """
+        The metrics in the Prometheus text format
+        """
+        with self.lock:
+            values = self.values[:]
+        lines = []
+        for stage, description in STAGES.items():
+            name = f"{METRIC_PREFIX}{stage}_seconds"
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} histogram")
+            for series_index, (series_stage, action) in enumerate(self.series):
+                if series_stage != stage:
+                    continue
+                start = series_index * self.series_size
+                labels = f'action="{action}",' if action is not None else ""
+                count = 0
+                for bound, bucket_count in zip(BUCKETS + ("+Inf",), values[start:start + len(BUCKETS) + 1]):
+                    count += bucket_count
+                    lines.append(f'{name}_bucket{{{labels}le="{bound}"}} {format_value(count)}')
+                label_set = f"{{{labels.rstrip(',')}}}" if labels else ""
+                lines.append(f"{name}_sum{label_set} {format_value(values[start + self.series_size - 1])}")
+                lines.append(f"{name}_count{label_set} {format_value(count)}")
+        for kind, names in (("counter", COUNTERS), ("gauge", GAUGES)):
+            for metric, description in names.items():
+                name = f"{METRIC_PREFIX}{metric}"
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name} {format_value(values[self.values_offset + self.value_names.index(metric)])}")
+        return "\n".join(lines) + "\n"
+
+
+def format_value(value: float) -> str:
+    # counts are kept as floats in shared memory but should read as exact integers
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+_metrics = None
+
+
+def enable() -> Metrics:
+    """
+    Starts collecting metrics in this process and any it forks from now on
+    """
+    global _metrics
+    _metrics = Metrics()
+    return _metrics
+
+
+def observe(stage: str, seconds: float, action: str = None) -> None:
+    if _metrics is not None:
+        _metrics.observe(stage, seconds, action)
+
+
+def add(name: str, amount: float = 1) -> None:
+    if _metrics is not None:
+        _metrics.add(name, amount)
+
+
+@contextmanager
+def timed(stage: str, action: str = None):
+    """
+    Observes how long the with block took, does nothing unless metrics are enabled
+    """
+    if _metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _metrics.observe(stage, time.perf_counter() - started, action)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        body = self.server.metrics.exposition().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+def serve_metrics(metrics: Metrics, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Serves the metrics as plain text on a background thread
+    """
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    server.metrics = metrics
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
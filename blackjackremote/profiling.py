@@ -0,0 +1,97 @@
+"""
+Opt-in cProfile sampling of live sessions. Set BLACKJACKVM_PROFILE_DIR to profile sessions from startup, or send the
+server SIGUSR1 to toggle profiling for sessions that start afterwards. BLACKJACKVM_PROFILE_FRACTION picks the share of
+sessions that are profiled.
+
+Each profiled session writes one profile per label, named <pid>-<session>-<phase>.<input>.prof, where input is first,
+update, or the kind most of an input batch was: click, key, drag or control. Combine them with:
+    python -m blackjackremote.profiling profiles --label betting.click
+"""
+import argparse
+import cProfile
+import glob
+import itertools
+import os
+import pstats
+import random
+import signal
+from contextlib import contextmanager
+
+PROFILE_DIRECTORY_ENV = "BLACKJACKVM_PROFILE_DIR"
+PROFILE_FRACTION_ENV = "BLACKJACKVM_PROFILE_FRACTION"
+DEFAULT_DIRECTORY = "profiles"
+
+_enabled = bool(os.environ.get(PROFILE_DIRECTORY_ENV))
+_session_ids = itertools.count()
+
+
+def toggle(signum=None, frame=None) -> None:
+    """
+    Turns profiling of new sessions on or off, usable as a signal handler
+    """
+    global _enabled
+    _enabled = not _enabled
+    print(f"session profiling {'on' if _enabled else 'off'}")
+
+
+def install_signal_handler(signum: int = getattr(signal, "SIGUSR1", None)) -> None:
+    if signum is not None:
+        signal.signal(signum, toggle)
+
+
+class SessionProfiler:
+    """
+    Keeps a profile per label for one session and writes them out when the session ends
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.session_id = f"{os.getpid()}-{next(_session_ids)}"
+        self.profiles = {}
+
+    @contextmanager
+    def profile(self, label: str):
+        profile = self.profiles.get(label)
+        if profile is None:
+            profile = self.profiles[label] = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # newer pythons allow one active profiler per process, another session's thread has it
+            yield
+            return
+        try:
+            yield
+        finally:
+            profile.disable()
+
+    def dump(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        for label, profile in self.profiles.items():
+            if profile.getstats():
+                profile.dump_stats(os.path.join(self.directory, f"{self.session_id}-{label}.prof"))
+
+
+def start_session_profiler():
+    """
+    :return: A SessionProfiler if profiling is on and this session was sampled, otherwise None
+    """
+    if not _enabled or random.random() >= float(os.environ.get(PROFILE_FRACTION_ENV, 1)):
+        return None
+    return SessionProfiler(os.environ.get(PROFILE_DIRECTORY_ENV) or DEFAULT_DIRECTORY)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", nargs="?", default=DEFAULT_DIRECTORY)
+    parser.add_argument("--label", default="*", help="phase.input label to combine, e.g. playermove.click or *.key")
+    parser.add_argument("--sort", default="cumulative")
+    parser.add_argument("--limit", type=int, default=30)
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.directory, f"*-{args.label}.prof")))
+    if not paths:
+        parser.error(f"no profiles labelled {args.label} in {args.directory}")
+    stats = pstats.Stats(*paths)
+    print(f"{len(paths)} profiles")
+    stats.sort_stats(args.sort).print_stats(args.limit)
@@ -0,0 +1,139 @@
+import gzip
+import itertools
+import json
+import os
+import threading
+import time
+
+SESSION_LOG_VERSION = 1
+# login replies carry the auth token on their second line, it is swapped for this in recordings
+REDACTED_AUTH = "recorded-auth"
+
+_session_ids = itertools.count()
+
+
+class SessionRecorder:
+    """
+    Writes one session's input lines, backend replies and timing to a gzipped json lines log that
+    ReplayBackend can re-drive without a backend. Safe to record from the backend executor's threads
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.file = gzip.open(path, "wt", encoding="utf-8")
+        self.write({"version": SESSION_LOG_VERSION, "started": time.time()})
+
+    @staticmethod
+    def in_directory(directory: str) -> "SessionRecorder":
+        """
+        Starts a log with a unique name in directory
+        """
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_session_ids)}.jsonl.gz"
+        return SessionRecorder(os.path.join(directory, name))
+
+    def elapsed(self) -> float:
+        return round(time.perf_counter() - self.started, 4)
+
+    def write(self, event: dict) -> None:
+        with self.lock:
+            if not self.file.closed:
+                self.file.write(json.dumps(event, separators=(",", ":")) + "\n")
+
+    def record_frame(self, kind: str, started: float, frame, line: bytes = None, refresh: bool = False) -> None:
+        """
+        :param kind: "first", "input" or "update"
+        :param started: perf_counter() from before the frame was made
+        :param frame: The frame sent to the client, None if there was nothing to send
+        :param line: The input line for an input event
+        :param refresh: Whether an update event started polling the backend for the game state
+        """
+        event = {"t": round(started - self.started, 4), "kind": kind,
+                 "ms": round((time.perf_counter() - started) * 1000, 3), "bytes": len(frame) if frame is not None else 0}
+        if line is not None:
+            event["line"] = line.decode("utf-8", "replace")
+        if refresh:
+            event["refresh"] = True
+        self.write(event)
+
+    def record_reply(self, method: str, reply: str) -> None:
+        self.write({"t": self.elapsed(), "kind": "backend", "method": method, "reply": reply})
+
+    def close(self) -> None:
+        with self.lock:
+            self.file.close()
+
+
+class RecordingBackend:
+    """
+    Passes calls through to a BackendClient and records every reply
+    """
+
+    def __init__(self, backend, recorder: SessionRecorder) -> None:
+        super().__init__()
+        self.backend = backend
+        self.recorder = recorder
+
+    def register(self, username: str) -> str:
+        reply = self.backend.register(username)
+        self.recorder.record_reply("register", reply)
+        return reply
+
+    def login(self, username: str, totp: str) -> str:
+        reply = self.backend.login(username, totp)
+        lines = reply.split("\n")
+        if lines[0] == "success" and len(lines) > 1:
+            lines[1] = REDACTED_AUTH
+        self.recorder.record_reply("login", "\n".join(lines))
+        return reply
+
+    def poll(self, username: str, auth: str) -> str:
+        reply = self.backend.poll(username, auth)
+        self.recorder.record_reply("poll", reply)
+        return reply
+
+    def input(self, username: str, auth: str, move: str) -> str:
+        reply = self.backend.input(username, auth, move)
+        self.recorder.record_reply("input", reply)
+        return reply
+
+
+def read_session_log(path: str):
+    """
+    :return: (header, events) of a log written by SessionRecorder
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        if header.get("version") != SESSION_LOG_VERSION:
+            raise ValueError(f"{path} is a version {header.get('version')} session log, expected {SESSION_LOG_VERSION}")
+        return header, [json.loads(line) for line in f]
+
+
+class ReplayBackend:
+    """
+    Answers backend calls with the replies recorded in a session log, in the order they were recorded
+    """
+
+    def __init__(self, events) -> None:
+        super().__init__()
+        self.replies = [event for event in events if event["kind"] == "backend"]
+
+    def next_reply(self, method: str) -> str:
+        # background requests may have been answered in a different order than they are replayed
+        for index, event in enumerate(self.replies):
+            if event["method"] == method:
+                return self.replies.pop(index)["reply"]
+        raise LookupError(f"the session log has no more {method} replies")
+
+    def register(self, username: str) -> str:
+        return self.next_reply("register")
+
+    def login(self, username: str, totp: str) -> str:
+        return self.next_reply("login")
+
+    def poll(self, username: str, auth: str) -> str:
+        return self.next_reply("poll")
+
+    def input(self, username: str, auth: str, move: str) -> str:
+        return self.next_reply("input")
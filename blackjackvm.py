@@ -1,45 +1,772 @@
+import argparse
+import asyncio
+import os
+import select
+import selectors
+import signal
+import socket
 import socketserver
+import struct
+import sys
+import threading
+import time
+import traceback
+import weakref
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+
 import requests
 import pygame
+from blackjackremote import backend, blackjackcard, metrics, profiling
 from blackjackremote.blackjackprogram import BlackJackProgram
-from data.image_half_colour import OCSimpleImage
+from blackjackremote.session_log import SessionRecorder, RecordingBackend
+from data.image_half_colour import OCSimpleImage, FORMAT_RGB, FORMAT_INDEXED, COMPRESSED_STREAM_ACK
+from virtual_desktop.screensize import ScreenSize
 
 SERVER_IP = ("0.0.0.0", 6525)
+SESSION_TIMEOUT = 120
+REFRESH_INTERVAL = 2
+BINARY_FORMATS = {"rgb": FORMAT_RGB, "indexed": FORMAT_INDEXED}
+# input kinds profiles are labelled with, every other line is protocol control
+PROFILED_INPUTS = ("click", "key", "drag")
+# kept small so a slow client's frames wait where they can still be replaced instead of in the kernel
+SEND_BUFFER_BYTES = 64 * 1024
+COMPRESSION_LEVEL = 6
+# when set, every session is recorded to a log in this directory
+RECORD_DIRECTORY = None
+# cleared for the forking server, where every connection's process would run a poll thread of its own
+PERIODIC_REFRESH = True
+# connections the kernel queues for the server to accept
+LISTEN_BACKLOG = 128
+# a retiring prefork worker tells the parent with its pid
+RETIRED_PID = struct.Struct("=i")
+
+# fonts and images from data.loader are shared by every session, pygame can't render with them from two threads at once
+RENDER_LOCK = threading.Lock()
+
+
+class PollScheduler:
+    """
+    One thread per process that periodically asks every registered session to refresh its game state
+    """
+
+    def __init__(self, interval: float = REFRESH_INTERVAL) -> None:
+        self.interval = interval
+        self.sessions = weakref.WeakSet()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, name="poll-scheduler", daemon=True)
+        self.thread.start()
+
+    def register(self, session: "BlackJackSession") -> None:
+        with self.lock:
+            self.sessions.add(session)
+
+    def unregister(self, session: "BlackJackSession") -> None:
+        with self.lock:
+            self.sessions.discard(session)
+
+    def run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                sessions = list(self.sessions)
+            for session in sessions:
+                session.request_refresh()
+
+
+_poll_scheduler = None
+_poll_scheduler_pid = None
+
+
+def get_poll_scheduler() -> PollScheduler:
+    global _poll_scheduler, _poll_scheduler_pid
+    if _poll_scheduler is None or _poll_scheduler_pid != os.getpid():
+        _poll_scheduler = PollScheduler()
+        _poll_scheduler_pid = os.getpid()
+    return _poll_scheduler
+
+
+class BlackJackSession:
+    """
+    One player's program and the frame encoding state of their connection, independent of how the bytes are carried.
+    Input lines that arrive together are applied in order and answered with one frame.
+    Besides click/key/drag a client may send:
+    mode delta - after the next keyframe, only send the regions that changed since the previous frame
+    mode full - go back to sending every frame in full (the default)
+    keyframe - send the next frame in full
+    format rgb|indexed - switch to length prefixed binary frames, starting with a keyframe
+    format rle - send ascii keyframes as a palette plus run length encoded rows when that is smaller
+    format ascii - go back to newline terminated ascii frames (the default)
+    push on - run backend requests in the background, replying at once with a pending screen and pushing a frame
+              without waiting for input when the reply arrives. The game state is also refreshed every few seconds
+              and pushed when it changes, except on the forking server where every connection is a process of its own
+              and would need its own polling thread
+    push off - wait for the backend before replying to an input (the default)
+    compress zlib - for the rest of the connection, after an uncompressed "compress zlib" line everything sent is one
+                    zlib stream that is flushed at the end of every frame
+    """
+
+    def __init__(self, on_update=None, backend_client: backend.BackendClient = None, recorder: SessionRecorder = None) -> None:
+        """
+        :param on_update: Called from another thread when poll_update may have a frame to push
+        :param backend_client: The backend to use instead of the process' shared one
+        :param recorder: Records the session's inputs, backend replies and timing for replaying later
+        """
+        self.recorder = recorder
+        if recorder is not None:
+            backend_client = RecordingBackend(backend_client if backend_client is not None else backend.get_backend(), recorder)
+        self.render_surf = pygame.Surface((160, 100))
+        self.game = BlackJackProgram(self.render_surf, backend_client)
+        self.game.on_update = on_update
+        self.refresh_due = False
+        self.delta_frames = False
+        self.last_frame = None
+        self.binary_format = None
+        self.rle_frames = False
+        self.last_serialized = None
+        self.compressed_stream = False
+        self.profiler = profiling.start_session_profiler()
+
+    def first_frame(self) -> bytes:
+        started = time.perf_counter()
+        with self.profile("first"):
+            frame = self.render_frame()
+        if self.recorder is not None:
+            self.recorder.record_frame("first", started, frame)
+        return frame
+
+    def handle_line(self, line: bytes) -> bytes:
+        """
+        Applies one input line to the program
+        :param line: The line the client sent
+        :return: The frame to send back
+        """
+        return self.handle_lines([line])
+
+    def handle_lines(self, lines) -> bytes:
+        """
+        Applies input lines to the program in order, then renders and encodes once for all of them
+        :param lines: The lines the client sent, oldest first
+        :return: The frame to send back
+        """
+        started = time.perf_counter()
+        metrics.add("inputs_total", len(lines))
+        user_inputs = self.merge_drags([line.decode("utf-8").strip().split(" ") for line in lines])
+        with self.profile(self.input_kind(user_inputs)):
+            self.game.apply_replies()
+            for user_input in user_inputs:
+                self.apply_input(user_input)
+            if self.game.is_dirty():
+                frame = self.render_frame()
+            else:
+                frame = self.encode_unchanged()
+        if self.recorder is not None:
+            self.recorder.record_frame("input", started, frame, b"".join(lines))
+        return frame
+
+    @staticmethod
+    def input_kind(user_inputs) -> str:
+        """
+        :return: The kind most of the inputs are, click, key or drag, or control for protocol lines
+        """
+        kinds = Counter(user_input[0] if user_input[0] in PROFILED_INPUTS else "control" for user_input in user_inputs)
+        return kinds.most_common(1)[0][0]
+
+    @staticmethod
+    def merge_drags(user_inputs):
+        """
+        Adds up runs of adjacent drags into one relative move
+        """
+        merged = []
+        for user_input in user_inputs:
+            if user_input[0] == 'drag' and merged and merged[-1][0] == 'drag':
+                previous = merged[-1]
+                merged[-1] = ['drag', str(int(previous[1]) + int(user_input[1])), str(int(previous[2]) + int(user_input[2]))]
+            else:
+                merged.append(user_input)
+        return merged
+
+    def apply_input(self, user_input) -> None:
+        if user_input[0] == 'click':
+            self.game.mouse_click(int(user_input[1]), int(user_input[2]))
+        elif user_input[0] == 'key':
+            self.game.key_input(int(user_input[1]), int(user_input[2]))
+        elif user_input[0] == 'drag':
+            self.game.mouse_relative_move(int(user_input[1]), int(user_input[2]))
+        elif user_input[0] == 'mode':
+            self.delta_frames = user_input[1] == 'delta'
+            self.last_frame = None
+        elif user_input[0] == 'keyframe':
+            self.last_frame = None
+        elif user_input[0] == 'format':
+            self.binary_format = BINARY_FORMATS.get(user_input[1])
+            self.rle_frames = user_input[1] == 'rle'
+            self.last_frame = None
+        elif user_input[0] == 'compress':
+            self.compressed_stream = self.compressed_stream or user_input[1] == 'zlib'
+        elif user_input[0] == 'push':
+            if user_input[1] == 'on':
+                self.game.backend_executor = backend.get_backend_executor()
+                if PERIODIC_REFRESH:
+                    get_poll_scheduler().register(self)
+            else:
+                self.game.backend_executor = None
+                if PERIODIC_REFRESH:
+                    get_poll_scheduler().unregister(self)
+
+    def request_refresh(self) -> None:
+        """
+        Asks for the game state to be refreshed on the session's own thread, safe to call from any thread
+        """
+        self.refresh_due = True
+        if self.game.on_update is not None:
+            self.game.on_update()
+
+    def poll_update(self):
+        """
+        Applies backend replies that arrived in the background and starts a refresh if one is due
+        :return: A frame to push to the client, or None if the screen didn't change
+        """
+        started = time.perf_counter()
+        with self.profile("update"):
+            self.game.apply_replies()
+            refresh = False
+            if self.refresh_due:
+                self.refresh_due = False
+                refresh = self.game.refresh_game_state()
+            frame = None
+            if self.game.is_dirty():
+                frame = self.render_frame()
+        if self.recorder is not None and (refresh or frame is not None):
+            self.recorder.record_frame("update", started, frame, refresh=refresh)
+        return frame
+
+    def profile(self, input_kind: str):
+        """
+        Profiles the with block under the current screen and input_kind if this session is being profiled
+        """
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.profile(f"{self.game.get_screen_name()}.{input_kind}")
+
+    def render_frame(self) -> bytes:
+        with RENDER_LOCK, metrics.timed("render"):
+            self.game.render()
+        return self.encode_frame()
+
+    def encode_frame(self) -> bytes:
+        with metrics.timed("encode"):
+            frame = OCSimpleImage(self.render_surf)
+            send_delta = self.delta_frames and self.last_frame is not None and self.last_frame.pixels.shape == frame.pixels.shape
+            if self.binary_format is not None:
+                serialized = frame.serialize_binary(self.binary_format, frame.changed_regions(self.last_frame) if send_delta else None)
+            elif send_delta:
+                serialized = (frame.serialize_delta(self.last_frame)+"\n").encode('utf-8')
+            elif self.rle_frames:
+                serialized = (frame.serialize_rle()+"\n").encode('utf-8')
+            else:
+                serialized = (frame.serialize()+"\n").encode('utf-8')
+        self.last_frame = frame
+        self.last_serialized = serialized
+        return serialized
+
+    def keyframe(self) -> bytes:
+        """
+        Encodes the current screen in full, replacing frames that were dropped before the client received them
+        """
+        if not self.delta_frames:
+            return self.last_serialized
+        self.last_frame = None
+        return self.encode_frame()
+
+    def encode_unchanged(self) -> bytes:
+        """
+        Replies to an input that did not change the screen without rendering or encoding it again
+        """
+        if self.last_frame is None:
+            # a keyframe was asked for, the surface still holds the last render
+            return self.encode_frame()
+        elif self.delta_frames and self.binary_format is not None:
+            return self.last_frame.serialize_binary(FORMAT_RGB, [])
+        elif self.delta_frames:
+            return b"delta\n"
+        else:
+            return self.last_serialized
+
+    def close(self) -> None:
+        try:
+            if self.game.backend_executor is not None and PERIODIC_REFRESH:
+                get_poll_scheduler().unregister(self)
+            if self.recorder is not None:
+                self.recorder.close()
+            if self.profiler is not None:
+                self.profiler.dump()
+        finally:
+            metrics.add("sessions_active", -1)
+
+
+def open_session(on_update=None) -> BlackJackSession:
+    """
+    Starts a session for a new connection, recording it if RECORD_DIRECTORY is set
+    """
+    recorder = SessionRecorder.in_directory(RECORD_DIRECTORY) if RECORD_DIRECTORY is not None else None
+    session = BlackJackSession(on_update, recorder=recorder)
+    metrics.add("sessions_total")
+    metrics.add("sessions_active")
+    return session
+
+
+def split_lines(input_buffer: bytearray):
+    """
+    Removes every complete line from the front of input_buffer
+    :return: The lines, oldest first
+    """
+    lines = []
+    line_end = input_buffer.find(b"\n")
+    start = 0
+    while line_end != -1:
+        lines.append(bytes(input_buffer[start:line_end + 1]))
+        start = line_end + 1
+        line_end = input_buffer.find(b"\n", start)
+    del input_buffer[:start]
+    return lines
+
+
+def count_frame(frame: bytes) -> None:
+    metrics.add("frames_sent_total")
+    metrics.add("bytes_sent_total", len(frame))
+
+
+def tune_socket(sock) -> None:
+    # frames are written whole, don't hold the end of one back waiting for more
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER_BYTES)
+
+
+class FrameQueue:
+    """
+    The frame waiting for a connection to finish receiving the one before it. A client that falls behind only ever
+    has one frame waiting, the sender replaces it with a keyframe of the newest screen
+    """
+
+    def __init__(self) -> None:
+        self.waiting = None
+        self.compressor = None
+        self.acknowledge_compression = False
+
+    def start_compression(self) -> None:
+        """
+        Compresses every frame popped from now on into one zlib stream, starting with the acknowledgement
+        """
+        self.compressor = zlib.compressobj(COMPRESSION_LEVEL)
+        self.acknowledge_compression = True
+
+    def behind(self) -> bool:
+        return self.waiting is not None
+
+    def push(self, frame: bytes) -> None:
+        if self.waiting is not None:
+            metrics.add("frames_dropped_total")
+        self.waiting = frame
+
+    def pop(self):
+        """
+        :return: The waiting frame as it should be written, None if there isn't one
+        """
+        frame, self.waiting = self.waiting, None
+        if frame is None or self.compressor is None:
+            return frame
+        # flushing at each frame lets the client decode it straight away while keeping the dictionary
+        frame = self.compressor.compress(frame) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        if self.acknowledge_compression:
+            self.acknowledge_compression = False
+            frame = COMPRESSED_STREAM_ACK + b"\n" + frame
+        return frame
+
+    def pending_bytes(self) -> int:
+        return len(self.waiting) if self.waiting is not None else 0
+
 
 class BlackJackVM(socketserver.StreamRequestHandler):
-    timeout = 120
+    timeout = SESSION_TIMEOUT
 
     def setup(self) -> None:
         print("new connection")
         super().setup()
+        tune_socket(self.connection)
+        # frames are written as far as the socket takes them, the rest waits in sending
+        self.connection.setblocking(False)
+        self.outgoing = FrameQueue()
+        self.sending = memoryview(b"")
 
     def handle(self) -> None:
-        render_surf = pygame.Surface((160, 100))
-        game = BlackJackProgram(render_surf)
-        game.render()
-        self.wfile.write((OCSimpleImage(render_surf).serialize()+"\n").encode('utf-8'))
-        running = True
-        while running:
-            user_input = self.rfile.readline().decode("utf-8").strip().split(" ")
-            if user_input[0] == 'click':
-                game.mouse_click(int(user_input[1]), int(user_input[2]))
-            elif user_input[0] == 'key':
-                game.key_input(int(user_input[1]), int(user_input[2]))
-            elif user_input[0] == 'drag':
-                game.mouse_relative_move(int(user_input[1]), int(user_input[2]))
-            game.render()
-            self.wfile.write((OCSimpleImage(render_surf).serialize()+"\n").encode('utf-8'))
+        # the session pokes this socket pair from another thread when it has a frame to push
+        wake_read, wake_write = socket.socketpair()
+        session = open_session(partial(self.wake, wake_write))
+        with wake_read, wake_write:
+            try:
+                self.send(session, session.first_frame())
+                self.serve_session(session, wake_read)
+            finally:
+                session.close()
+
+    def serve_session(self, session: BlackJackSession, wake_read: socket.socket) -> None:
+        input_buffer = bytearray()
+        last_input = time.monotonic()
+        # a prefork worker runs many sessions at once, their descriptors soon pass what select.select can take
+        with selectors.DefaultSelector() as selector:
+            selector.register(wake_read, selectors.EVENT_READ)
+            selector.register(self.connection, selectors.EVENT_READ)
+            waiting_for = selectors.EVENT_READ
+            while True:
+                # pushed frames don't count as activity, only the client can keep its session open
+                idle_left = last_input + self.timeout - time.monotonic()
+                if idle_left <= 0:
+                    break
+                wanted = selectors.EVENT_READ | (selectors.EVENT_WRITE if self.undelivered_bytes() else 0)
+                if wanted != waiting_for:
+                    selector.modify(self.connection, wanted)
+                    waiting_for = wanted
+                ready = {key.fileobj: events for key, events in selector.select(idle_left)}
+                connection_events = ready.get(self.connection, 0)
+                if connection_events & selectors.EVENT_WRITE:
+                    self.flush()
+                if wake_read in ready:
+                    wake_read.recv(4096)
+                    frame = session.poll_update()
+                    if frame is not None:
+                        self.send(session, frame)
+                if connection_events & selectors.EVENT_READ:
+                    with metrics.timed("input_read"):
+                        # take everything the client has sent so far, all of it is answered with one frame
+                        data = self.connection.recv(65536)
+                        input_buffer.extend(data)
+                        lines = split_lines(input_buffer)
+                    if not data:
+                        break
+                    last_input = time.monotonic()
+                    if lines:
+                        self.send(session, session.handle_lines(lines))
 
+    def undelivered_bytes(self) -> int:
+        """
+        Bytes of frames made for this client that haven't been handed to the socket yet
+        """
+        return len(self.sending) + self.outgoing.pending_bytes()
+
+    def send(self, session: BlackJackSession, frame: bytes) -> None:
+        if self.outgoing.behind():
+            # the client hasn't started on the waiting frame, the newest screen in full replaces it and this one
+            frame = session.keyframe()
+        if session.compressed_stream and self.outgoing.compressor is None:
+            self.outgoing.start_compression()
+        self.outgoing.push(frame)
+        self.flush()
+
+    def flush(self) -> None:
+        with metrics.timed("write"):
+            while True:
+                if not self.sending:
+                    frame = self.outgoing.pop()
+                    if frame is None:
+                        return
+                    count_frame(frame)
+                    self.sending = memoryview(frame)
+                try:
+                    sent = self.connection.send(self.sending)
+                except BlockingIOError:
+                    return
+                self.sending = self.sending[sent:]
+
+    @staticmethod
+    def wake(wake_write: socket.socket) -> None:
+        try:
+            wake_write.send(b"\0")
+        except OSError:
+            # the connection has already closed
+            pass
 
     def finish(self) -> None:
         super().finish()
 
 
+async def handle_async_session(executor: ThreadPoolExecutor, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """
+    Runs one session on the event loop, input handling, rendering and encoding happen on the executor
+    """
+    print("new connection")
+    loop = asyncio.get_running_loop()
+    update = asyncio.Event()
+
+    def on_update():
+        try:
+            loop.call_soon_threadsafe(update.set)
+        except RuntimeError:
+            # the event loop has already shut down
+            pass
+
+    tune_socket(writer.get_extra_info("socket"))
+    # drain only returns once a frame is all in the socket, frames after it wait in outgoing where they can be replaced
+    writer.transport.set_write_buffer_limits(0)
+    outgoing = FrameQueue()
+    frame_ready = asyncio.Event()
+
+    async def queue_frame(frame: bytes) -> None:
+        if outgoing.behind():
+            # the client hasn't started on the waiting frame, the newest screen in full replaces it and this one
+            frame = await loop.run_in_executor(executor, session.keyframe)
+        if session.compressed_stream and outgoing.compressor is None:
+            outgoing.start_compression()
+        outgoing.push(frame)
+        frame_ready.set()
+
+    read_task = None
+    write_task = asyncio.ensure_future(write_frames(writer, outgoing, frame_ready))
+    session = None
+    input_buffer = bytearray()
+    try:
+        session = await loop.run_in_executor(executor, open_session, on_update)
+        await queue_frame(await loop.run_in_executor(executor, session.first_frame))
+        last_input = loop.time()
+        while True:
+            # pushed frames don't count as activity, only the client can keep its session open
+            idle_left = last_input + SESSION_TIMEOUT - loop.time()
+            if idle_left <= 0:
+                break
+            if read_task is None:
+                read_task = asyncio.ensure_future(reader.read(65536))
+            update_task = asyncio.ensure_future(update.wait())
+            done, _ = await asyncio.wait((read_task, update_task, write_task), timeout=idle_left, return_when=asyncio.FIRST_COMPLETED)
+            update_task.cancel()
+            if write_task.done():
+                # raises whatever stopped the writes
+                write_task.result()
+            if update.is_set():
+                update.clear()
+                frame = await loop.run_in_executor(executor, session.poll_update)
+                if frame is not None:
+                    await queue_frame(frame)
+            if read_task.done():
+                data = read_task.result()
+                read_task = None
+                if not data:
+                    break
+                last_input = loop.time()
+                # everything the client has sent so far is answered with one frame
+                input_buffer.extend(data)
+                lines = split_lines(input_buffer)
+                if lines:
+                    await queue_frame(await loop.run_in_executor(executor, session.handle_lines, lines))
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        if read_task is not None:
+            read_task.cancel()
+        write_task.cancel()
+        if session is not None:
+            session.close()
+        writer.close()
+
+
+async def write_frames(writer: asyncio.StreamWriter, outgoing: FrameQueue, frame_ready: asyncio.Event) -> None:
+    while True:
+        await frame_ready.wait()
+        frame_ready.clear()
+        frame = outgoing.pop()
+        while frame is not None:
+            count_frame(frame)
+            started = time.perf_counter()
+            writer.write(frame)
+            await asyncio.wait_for(writer.drain(), SESSION_TIMEOUT)
+            metrics.observe("write", time.perf_counter() - started)
+            frame = outgoing.pop()
+
+
+async def serve_async(address, max_workers: int) -> None:
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    async def on_connect(reader, writer):
+        await handle_async_session(executor, reader, writer)
+
+    server = await asyncio.start_server(on_connect, *address)
+    async with server:
+        await server.serve_forever()
+
+
+def warm_caches() -> None:
+    """
+    Builds the card sprites and renders and encodes the login screen once, so the caches behind them are filled before
+    any session needs them
+    """
+    blackjackcard.build_card_sprites(ScreenSize.SMALL)
+    session = BlackJackSession()
+    session.first_frame()
+    session.binary_format = FORMAT_INDEXED
+    session.encode_frame()
+
+
+class PreforkWorker(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    One long lived worker process of the prefork server, running every session it accepts on its own thread.
+    It stops accepting after max_sessions and exits once those sessions have ended
+    """
+
+    def __init__(self, listener: socket.socket, max_sessions: int) -> None:
+        super().__init__(listener.getsockname(), BlackJackVM, bind_and_activate=False)
+        # accept from the socket every worker shares instead of the one TCPServer made
+        self.socket.close()
+        self.socket = listener
+        self.max_sessions = max_sessions
+        self.sessions_started = 0
+
+    def process_request(self, request, client_address) -> None:
+        self.sessions_started += 1
+        super().process_request(request, client_address)
+
+    def serve_until_retired(self) -> None:
+        # handle_request would take the non-blocking listener's zero timeout and never wait, so wait here instead
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.socket, selectors.EVENT_READ)
+            while self.sessions_started < self.max_sessions:
+                selector.select()
+                # workers race for each connection, the ones that lose find nothing to accept and wait again
+                self._handle_request_noblock()
+
+
+def run_prefork_worker(listener: socket.socket, max_sessions: int, retire_write: int) -> None:
+    with PreforkWorker(listener, max_sessions) as worker:
+        worker.serve_until_retired()
+        # the parent starts a replacement while the sessions already accepted here finish
+        os.write(retire_write, RETIRED_PID.pack(os.getpid()))
+        listener.close()
+
+
+def serve_prefork(address, processes: int, max_sessions: int) -> None:
+    """
+    Keeps a pool of worker processes accepting from one listening socket, replacing each as it retires.
+    Caches are warmed before forking so every worker, including replacements, starts with them
+    """
+    # imported here as it only exists where fork does
+    import resource
+    # each session holds a connection, its wake socket pair and a selector, a worker with many needs more than the
+    # usual soft limit of descriptors
+    _, hard_limit = resource.getrlimit(resource.RLIMIT_NOFILE)
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard_limit, hard_limit))
+    except (ValueError, OSError):
+        print("couldn't raise the open file limit")
+    warm_caches()
+    listener = socket.create_server(address, backlog=LISTEN_BACKLOG)
+    listener.setblocking(False)
+    retire_read, retire_write = os.pipe()
+    accepting = set()
+    running = set()
+
+    def toggle_profiling(signum, frame) -> None:
+        # workers outlive the toggle, so pass it on as well as remembering it for the ones started later
+        profiling.toggle()
+        signal_workers(signum)
+
+    def signal_workers(signum) -> None:
+        for pid in running:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                # exited since it was last reaped
+                pass
+
+    def start_worker() -> int:
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                os.close(retire_read)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                profiling.install_signal_handler()
+                run_prefork_worker(listener, max_sessions, retire_write)
+                status = 0
+            except KeyboardInterrupt:
+                pass
+            except BaseException:
+                # the parent quietly replaces workers that die, this is the only trace of why
+                traceback.print_exc()
+            finally:
+                # _exit skips flushing what the worker printed
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(status)
+        return pid
+
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, toggle_profiling)
+    # stopping the parent stops the workers too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+    try:
+        while True:
+            while len(accepting) < processes:
+                pid = start_worker()
+                accepting.add(pid)
+                running.add(pid)
+            readable, _, _ = select.select([retire_read], [], [], 1)
+            if readable:
+                retired = os.read(retire_read, RETIRED_PID.size * 64)
+                accepting.difference_update(pid for pid, in RETIRED_PID.iter_unpack(retired))
+            while running:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+                if pid == 0:
+                    break
+                # workers that crashed never said they retired
+                accepting.discard(pid)
+                running.discard(pid)
+    finally:
+        signal_workers(signal.SIGTERM)
+        listener.close()
+
+
 if __name__ == '__main__':
-    if hasattr(socketserver, 'ForkingTCPServer'):
-        server_backend = socketserver.ForkingTCPServer
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--server", choices=("fork", "async", "prefork"), default="fork")
+    parser.add_argument("--workers", type=int, default=8, help="executor threads for the async server")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="worker processes for the prefork server")
+    parser.add_argument("--max-sessions", type=int, default=1000,
+                        help="sessions a prefork worker accepts before it's replaced, containing anything it leaks")
+    parser.add_argument("--backend-connect-timeout", type=float, default=backend.CONNECT_TIMEOUT)
+    parser.add_argument("--backend-read-timeout", type=float, default=backend.READ_TIMEOUT)
+    parser.add_argument("--record", metavar="DIRECTORY", help="record every session to a log in this directory")
+    parser.add_argument("--metrics-port", type=int, help="serve stage timings and session counters as plain text on this local port")
+    args = parser.parse_args()
+
+    profiling.install_signal_handler()
+
+    if args.metrics_port is not None:
+        metrics.serve_metrics(metrics.enable(), args.metrics_port)
+
+    if args.record is not None:
+        os.makedirs(args.record, exist_ok=True)
+        RECORD_DIRECTORY = args.record
+
+    backend.configure_backend(connect_timeout=args.backend_connect_timeout, read_timeout=args.backend_read_timeout,
+                              pool_size=max(backend.POOL_SIZE, args.workers))
+
+    if args.server == 'async':
+        asyncio.run(serve_async(SERVER_IP, args.workers))
+    elif args.server == 'prefork':
+        serve_prefork(SERVER_IP, args.processes, args.max_sessions)
     else:
-        server_backend = socketserver.ThreadingTCPServer
+        if hasattr(socketserver, 'ForkingTCPServer'):
+            server_backend = socketserver.ForkingTCPServer
+            PERIODIC_REFRESH = False
+        else:
+            server_backend = socketserver.ThreadingTCPServer
 
-    with server_backend(SERVER_IP, BlackJackVM) as server:
-        server.serve_forever()
+        with server_backend(SERVER_IP, BlackJackVM, bind_and_activate=False) as server:
+            # closed sessions leave the port in TIME_WAIT, don't let that stop a restart
+            server.allow_reuse_address = True
+            # forking each session is slow, socketserver's default backlog of 5 overflows when players arrive together
+            server.request_queue_size = LISTEN_BACKLOG
+            server.server_bind()
+            server.server_activate()
+            server.serve_forever()
@@ -1,15 +1,51 @@
+import hashlib
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
 from PIL import Image
-from pygame import image, Surface, surfarray, transform
+from pygame import image, Surface, surfarray
+
+
+# binary frames start with a byte that can never begin an ascii frame, followed by the length of the rest of the frame
+BINARY_FRAME_MARKER = 0
+BINARY_FRAME_PREFIX = struct.Struct(">BI")
+BINARY_FRAME_HEADER = struct.Struct(">BHHH")
+BINARY_REGION_HEADER = struct.Struct(">HHHH")
+BINARY_PALETTE_HEADER = struct.Struct(">H")
+
+FORMAT_RGB = 0
+FORMAT_INDEXED = 1
+
+# sent uncompressed by the server just before its output becomes one zlib stream
+COMPRESSED_STREAM_ACK = b"compress zlib"
+
+# rle frames spend one character on a palette index and one on a run length, both from the 94 character alphabet
+RLE_MAX_PALETTE = 94
+RLE_MAX_RUN = 94
+
+DECODED_CACHE_BYTES = 8 * 1024 * 1024
 
 
 class OCSimpleImage:
     def __init__(self, image=None):
-
+        # pixels are stored row-major as a (height, width, 3) uint8 array
         if isinstance(image, Surface):
-            image = Image.fromarray(surfarray.pixels3d(transform.flip(transform.rotate(image, 90), False, True)), mode="RGB")
+            self.pixels = surfarray.array3d(image).transpose(1, 0, 2)
+        elif image is not None:
+            self.pixels = np.asarray(image.convert(mode="RGB"))
+        else:
+            self.pixels = None
 
-        self.image = image.convert(mode="RGBA") if image else None
+    @property
+    def width(self):
+        return self.pixels.shape[1]
 
+    @property
+    def height(self):
+        return self.pixels.shape[0]
 
     @staticmethod
     def _byte_encode(byte):
@@ -21,30 +57,334 @@ class OCSimpleImage:
         return int((ord(byte) - ord('!')) * 255 / 94)
 
     def serialize(self):
-        data_blob = ''.join(f"{OCSimpleImage._byte_encode(r)}{OCSimpleImage._byte_encode(g)}{OCSimpleImage._byte_encode(b)}" for r,g,b,a in self.image.getdata())
-        return f"{self.image.width} {data_blob}"
+        data_blob = _ENCODE_TABLE[self.pixels].tobytes().decode('ascii')
+        return f"{self.width} {data_blob}"
+
+    def serialize_rle(self):
+        """
+        Encodes a per frame palette followed by runs of palette indices, runs never cross a row boundary.
+        Falls back to serialize when the palette overflows or the runs would not be smaller
+        :return: "rle width palette runs", or the plain serialized frame
+        """
+        encoded = _ENCODE_TABLE[self.pixels]
+        packed = (encoded[..., 0].astype(np.uint32) << 16) | (encoded[..., 1].astype(np.uint32) << 8) | encoded[..., 2]
+        colours, indices = np.unique(packed, return_inverse=True)
+        if len(colours) > RLE_MAX_PALETTE:
+            return self.serialize()
+        indices = indices.reshape(packed.shape)
+
+        run_starts = np.ones(indices.shape, dtype=bool)
+        run_starts[:, 1:] = indices[:, 1:] != indices[:, :-1]
+        run_starts = np.flatnonzero(run_starts)
+        run_lengths = np.diff(np.append(run_starts, indices.size))
+        run_values = indices.ravel()[run_starts]
+
+        # runs longer than one character can express are split into several
+        pieces = -(-run_lengths // RLE_MAX_RUN)
+        piece_index = np.arange(pieces.sum()) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+        piece_lengths = np.minimum(RLE_MAX_RUN, np.repeat(run_lengths, pieces) - piece_index * RLE_MAX_RUN)
+        runs = np.empty((len(piece_lengths), 2), dtype=np.uint8)
+        runs[:, 0] = ord('!') + np.repeat(run_values, pieces)
+        runs[:, 1] = ord('!') + piece_lengths - 1
+
+        palette = np.stack(((colours >> 16) & 0xff, (colours >> 8) & 0xff, colours & 0xff), axis=1).astype(np.uint8)
+        serialized = f"rle {self.width} {palette.tobytes().decode('ascii')} {runs.tobytes().decode('ascii')}"
+        if len(serialized) >= indices.size * 3 + len(str(self.width)) + 1:
+            return self.serialize()
+        return serialized
+
+    def serialize_region(self, x, y, width, height):
+        data_blob = _ENCODE_TABLE[self.pixels[y:y+height, x:x+width]].tobytes().decode('ascii')
+        return f"{x} {y} {width} {data_blob}"
+
+    def serialize_delta(self, previous: "OCSimpleImage"):
+        """
+        Encodes only the regions that differ from a previous image of the same size
+        :param previous: The image the receiver currently has
+        :return: "delta" followed by an "x y width blob" group for each changed region
+        """
+        return ' '.join(["delta"] + [self.serialize_region(*region) for region in self.changed_regions(previous)])
+
+    def changed_regions(self, previous: "OCSimpleImage"):
+        """
+        Groups changed rows into bands and bounds each band by its changed columns
+        :param previous: The image to compare against
+        :return: (x, y, width, height) for every changed band, top to bottom
+        """
+        changed = (self.pixels != previous.pixels).any(axis=2)
+        changed_rows = np.flatnonzero(changed.any(axis=1))
+        if len(changed_rows) == 0:
+            return []
+        regions = []
+        for band in np.split(changed_rows, np.flatnonzero(np.diff(changed_rows) > 1) + 1):
+            top, bottom = int(band[0]), int(band[-1]) + 1
+            changed_columns = np.flatnonzero(changed[top:bottom].any(axis=0))
+            left, right = int(changed_columns[0]), int(changed_columns[-1]) + 1
+            regions.append((left, top, right - left, bottom - top))
+        return regions
+
+    def apply_delta(self, str):
+        """
+        Patches this image in place with a frame produced by serialize_delta
+        :param str: The delta frame
+        :return: self
+        """
+        if isinstance(str, (bytes, bytearray, memoryview)):
+            str = bytes(str)
+        else:
+            str = str.encode('ascii')
+        tokens = str.split()[1:]
+        if not self.pixels.flags.writeable:
+            self.pixels = self.pixels.copy()
+        for region_index in range(0, len(tokens), 4):
+            x, y, width = (int(token) for token in tokens[region_index:region_index+3])
+            data_blob = tokens[region_index+3]
+            height = (len(data_blob)//3)//width
+            region = _DECODE_TABLE[np.frombuffer(data_blob, dtype=np.uint8, count=width * height * 3)]
+            self.pixels[y:y+height, x:x+width] = region.reshape((height, width, 3))
+        return self
+
+    def serialize_binary(self, pixel_format=FORMAT_RGB, regions=None):
+        """
+        Encodes a length prefixed binary frame with raw rgb or 8 bit palette indexed pixels
+        :param pixel_format: FORMAT_RGB or FORMAT_INDEXED, indexed frames fall back to rgb when there are more than 256 colours
+        :param regions: (x, y, width, height) regions to send, the whole image when None
+        :return: The frame as bytes, including its prefix
+        """
+        if regions is None:
+            regions = [(0, 0, self.width, self.height)]
+        pixel_data = self.pixels
+        palette_block = b''
+        if pixel_format == FORMAT_INDEXED:
+            packed = (self.pixels[..., 0].astype(np.uint32) << 16) | (self.pixels[..., 1].astype(np.uint32) << 8) | self.pixels[..., 2]
+            colours, indices = np.unique(packed, return_inverse=True)
+            if len(colours) <= 256:
+                palette = np.stack(((colours >> 16) & 0xff, (colours >> 8) & 0xff, colours & 0xff), axis=1).astype(np.uint8)
+                palette_block = BINARY_PALETTE_HEADER.pack(len(colours)) + palette.tobytes()
+                pixel_data = indices.astype(np.uint8).reshape(packed.shape)
+            else:
+                pixel_format = FORMAT_RGB
+        body = [BINARY_FRAME_HEADER.pack(pixel_format, self.width, self.height, len(regions)), palette_block]
+        for x, y, width, height in regions:
+            body.append(BINARY_REGION_HEADER.pack(x, y, width, height))
+            body.append(pixel_data[y:y+height, x:x+width].tobytes())
+        body = b''.join(body)
+        return BINARY_FRAME_PREFIX.pack(BINARY_FRAME_MARKER, len(body)) + body
+
+    def apply_binary(self, frame):
+        """
+        Decodes a frame produced by serialize_binary onto this image, regions outside a keyframe keep their pixels
+        :param frame: The frame without its prefix
+        :return: self
+        """
+        frame = memoryview(frame)
+        pixel_format, width, height, num_regions = BINARY_FRAME_HEADER.unpack_from(frame)
+        offset = BINARY_FRAME_HEADER.size
+        if self.pixels is None or self.pixels.shape != (height, width, 3):
+            self.pixels = np.zeros((height, width, 3), dtype=np.uint8)
+        elif not self.pixels.flags.writeable:
+            self.pixels = self.pixels.copy()
+        if pixel_format == FORMAT_INDEXED:
+            palette_size, = BINARY_PALETTE_HEADER.unpack_from(frame, offset)
+            offset += BINARY_PALETTE_HEADER.size
+            palette = np.frombuffer(frame, dtype=np.uint8, count=palette_size * 3, offset=offset).reshape((palette_size, 3))
+            offset += palette_size * 3
+        for _ in range(num_regions):
+            x, y, region_width, region_height = BINARY_REGION_HEADER.unpack_from(frame, offset)
+            offset += BINARY_REGION_HEADER.size
+            if pixel_format == FORMAT_INDEXED:
+                num_bytes = region_width * region_height
+                region = palette[np.frombuffer(frame, dtype=np.uint8, count=num_bytes, offset=offset)]
+            else:
+                num_bytes = region_width * region_height * 3
+                region = np.frombuffer(frame, dtype=np.uint8, count=num_bytes, offset=offset)
+            offset += num_bytes
+            self.pixels[y:y+region_height, x:x+region_width] = region.reshape((region_height, region_width, 3))
+        return self
+
+    @staticmethod
+    def is_delta(str):
+        return str[:5] in ("delta", b"delta")
+
+    @staticmethod
+    def is_keyframe(frame, binary):
+        """
+        Whether a frame replaces the whole image, so frames received before it don't need decoding
+        :param frame: The frame, without its prefix if it is binary
+        :param binary: Whether it is a binary frame
+        """
+        if not binary:
+            return not OCSimpleImage.is_delta(frame)
+        pixel_format, width, height, num_regions = BINARY_FRAME_HEADER.unpack_from(frame)
+        offset = BINARY_FRAME_HEADER.size
+        if pixel_format == FORMAT_INDEXED:
+            palette_size, = BINARY_PALETTE_HEADER.unpack_from(frame, offset)
+            offset += BINARY_PALETTE_HEADER.size + palette_size * 3
+        return num_regions == 1 and BINARY_REGION_HEADER.unpack_from(frame, offset) == (0, 0, width, height)
 
     def deserialize(self, str, scale=1):
-        image_width_s, data_blob = str.split()
-        image_width = int(image_width_s)
-        image_height = (len(data_blob)//3)//image_width
-
-        out_image = Image.new("RGB", (image_width, image_height))
-
-        for pixel_index in range(0, len(data_blob), 3):
-            pixel_data = data_blob[pixel_index:pixel_index+3]
-            r = OCSimpleImage._byte_decode(pixel_data[:1])
-            g = OCSimpleImage._byte_decode(pixel_data[1:2])
-            b = OCSimpleImage._byte_decode(pixel_data[2:3])
-            pixel_pos = ((pixel_index//3) % image_width, pixel_index//3//image_width)
-            out_image.putpixel(pixel_pos, (r,g,b))
-        self.image = out_image.resize((out_image.width * scale, out_image.height * scale), resample=Image.NEAREST)
+        if isinstance(str, (bytes, bytearray, memoryview)):
+            str = bytes(str)
+        else:
+            str = str.encode('ascii')
+        if str[:3] == b"rle":
+            pixels = self._decode_rle(str)
+        else:
+            image_width_s, data_blob = str.split()
+            image_width = int(image_width_s)
+            image_height = (len(data_blob)//3)//image_width
+
+            pixels = _DECODE_TABLE[np.frombuffer(data_blob, dtype=np.uint8, count=image_width * image_height * 3)]
+            pixels = pixels.reshape((image_height, image_width, 3))
+        if scale != 1:
+            pixels = pixels.repeat(scale, axis=0).repeat(scale, axis=1)
+        self.pixels = pixels
         return self
+
+    @staticmethod
+    def _decode_rle(str):
+        _, image_width_s, palette_blob, run_blob = str.split()
+        image_width = int(image_width_s)
+        palette = _DECODE_TABLE[np.frombuffer(palette_blob, dtype=np.uint8)].reshape((-1, 3))
+        runs = np.frombuffer(run_blob, dtype=np.uint8).reshape((-1, 2)) - ord('!')
+        indices = np.repeat(runs[:, 0], runs[:, 1].astype(np.intp) + 1)
+        return palette[indices].reshape((-1, image_width, 3))
+
     def show(self):
-        self.image.show()
+        Image.fromarray(self.pixels, mode="RGB").show()
 
     def get_surface(self) -> Surface:
-        return image.frombuffer(self.image.tobytes(), (self.image.width, self.image.height), "RGB")
+        return image.frombuffer(np.ascontiguousarray(self.pixels), (self.width, self.height), "RGB")
+
+
+def read_frame(buffer):
+    """
+    Finds the first complete frame in a receive buffer, ascii frames end with a newline and binary frames are length prefixed
+    :param buffer: Bytes received so far
+    :return: (frame, binary, consumed) where frame is None if no frame has fully arrived
+    """
+    if len(buffer) == 0:
+        return None, False, 0
+    if buffer[0] == BINARY_FRAME_MARKER:
+        if len(buffer) < BINARY_FRAME_PREFIX.size:
+            return None, True, 0
+        _, frame_length = BINARY_FRAME_PREFIX.unpack_from(buffer)
+        frame_end = BINARY_FRAME_PREFIX.size + frame_length
+        if len(buffer) < frame_end:
+            return None, True, 0
+        return bytes(buffer[BINARY_FRAME_PREFIX.size:frame_end]), True, frame_end
+    line_end = buffer.find(b"\n")
+    if line_end == -1:
+        return None, False, 0
+    return bytes(buffer[:line_end]), False, line_end + 1
+
+
+class FrameReader:
+    """
+    Splits a received byte stream into frames like read_frame, but only scans bytes it hasn't looked at before and
+    drops consumed bytes once per feed instead of once per frame
+    """
+
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+        # how far the incomplete ascii frame at the start of the buffer has been searched for its newline
+        self.scanned = 0
+        self.decompressor = None
+
+    def feed(self, data):
+        """
+        :param data: Newly received bytes
+        :return: (frame, binary) for each frame data completed, oldest first
+        """
+        if self.decompressor is not None:
+            data = self.decompressor.decompress(data)
+        self.buffer += data
+        frames = self.split()
+        if frames and frames[-1] == (COMPRESSED_STREAM_ACK, False):
+            # everything after the acknowledgement is compressed
+            frames.pop()
+            compressed, self.buffer = bytes(self.buffer), bytearray()
+            self.scanned = 0
+            self.decompressor = zlib.decompressobj()
+            frames += self.feed(compressed)
+        return frames
+
+    def split(self):
+        """
+        Removes complete frames from the front of the buffer, stopping after a compressed stream acknowledgement
+        """
+        frames = []
+        start = 0
+        with memoryview(self.buffer) as view:
+            while start < len(view):
+                if view[start] == BINARY_FRAME_MARKER:
+                    if len(view) - start < BINARY_FRAME_PREFIX.size:
+                        break
+                    _, frame_length = BINARY_FRAME_PREFIX.unpack_from(view, start)
+                    frame_end = start + BINARY_FRAME_PREFIX.size + frame_length
+                    if frame_end > len(view):
+                        break
+                    frames.append((bytes(view[start + BINARY_FRAME_PREFIX.size:frame_end]), True))
+                    start = frame_end
+                else:
+                    line_end = self.buffer.find(b"\n", max(start, self.scanned))
+                    if line_end == -1:
+                        self.scanned = len(view)
+                        break
+                    frames.append((bytes(view[start:line_end]), False))
+                    start = line_end + 1
+                    if frames[-1][0] == COMPRESSED_STREAM_ACK:
+                        break
+        del self.buffer[:start]
+        self.scanned = max(0, self.scanned - start)
+        return frames
+
+
+class DecodedImageCache:
+    """
+    Least recently used cache of decoded surfaces, keyed by a digest of the serialized image and the scale it was
+    decoded at. Bounded by the total size of the pixel data it holds. Returned surfaces are shared between callers
+    so they must only be blitted, never drawn on
+    """
+
+    def __init__(self, max_bytes: int = DECODED_CACHE_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_surface(self, serialized, scale=1) -> Surface:
+        data = serialized.encode('ascii') if isinstance(serialized, str) else bytes(serialized)
+        key = (hashlib.blake2b(data, digest_size=16).digest(), scale)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return entry[0]
+        surface = OCSimpleImage().deserialize(data, scale).get_surface()
+        size = surface.get_width() * surface.get_height() * 3
+        with self.lock:
+            if key not in self.entries and size <= self.max_bytes:
+                self.entries[key] = (surface, size)
+                self.used_bytes += size
+                while self.used_bytes > self.max_bytes:
+                    _, (_, evicted_size) = self.entries.popitem(last=False)
+                    self.used_bytes -= evicted_size
+        return surface
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.used_bytes = 0
+
+
+decoded_image_cache = DecodedImageCache()
+
+
+# every possible channel value mapped to its wire character, built with the same expression as _byte_encode
+_ENCODE_TABLE = np.array([ord(OCSimpleImage._byte_encode(byte)) for byte in range(256)], dtype=np.uint8)
+# inverse mapping indexed by wire character, anything outside the encoded range decodes to 0
+_DECODE_TABLE = np.array([OCSimpleImage._byte_decode(chr(char)) if ord('!') <= char <= ord('!') + 94 else 0 for char in range(256)], dtype=np.uint8)
 
 if __name__ == '__main__':
     import gzip
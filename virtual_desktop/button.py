@@ -9,8 +9,24 @@ class Button:
         self.background_colour = background_colour
         self.label = label
         self.pos = pos
+        self.cached_key = None
+        self.cached_surface = None
 
     def render(self):
+        """
+        Returns the button's surface, only redrawing it when something it depends on has changed.
+        The surface is reused between calls so it must only be blitted, never drawn on
+        """
+        cache_key = self.get_cache_key()
+        if cache_key != self.cached_key:
+            self.cached_surface = self.draw()
+            self.cached_key = cache_key
+        return self.cached_surface
+
+    def get_cache_key(self):
+        return self.label, tuple(self.background_colour), tuple(self.text_colour), tuple(self.pos.size)
+
+    def draw(self):
         out_surface = Surface(self.pos.size)
         out_surface.fill(self.background_colour)
         button_label = font_small.render(self.label, False, self.text_colour)
@@ -11,7 +11,10 @@ class CoinButton(Button):
         super().__init__(Rect(pos, background_coin.get_size()), label, (0, 0, 0), text_colour)
         self.coin_icon = background_coin
 
-    def render(self):
+    def get_cache_key(self):
+        return self.label, tuple(self.text_colour), id(self.coin_icon)
+
+    def draw(self):
         out_coin = self.coin_icon.copy()
         rendered_coin_label = font_small.render(self.label, False, self.text_colour)
         out_coin.blit(rendered_coin_label, (out_coin.get_width()//2 - rendered_coin_label.get_width()//2, out_coin.get_height()//2 - rendered_coin_label.get_height()//2))
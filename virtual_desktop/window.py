@@ -1,5 +1,60 @@
+from typing import Callable, Hashable, List, Tuple
+
 from pygame import *
 
+# static layers only depend on the screen they belong to and its size, so every window shares them
+_static_layers = {}
+
+
+class Compositor:
+    """
+    Draws a window as a cached static layer per screen with dynamic elements on top,
+    only redrawing the areas where the elements changed
+    """
+
+    def __init__(self, target: Surface) -> None:
+        super().__init__()
+        self.target = target
+        self.screen_key = None
+        self.elements = []
+
+    def compose(self, screen_key: Hashable, draw_static: Callable[[Surface], None],
+                elements: List[Tuple[Hashable, Surface, Tuple[int, int]]]) -> List[Rect]:
+        """
+        Brings the target up to date with a screen
+        :param screen_key: Identifies the screen's static layer
+        :param draw_static: Draws the static layer onto the surface it's given, only called the first time the screen is seen
+        :param elements: (key, surface, position) of each dynamic element in draw order, elements are only redrawn when their
+        key or position changes so the key has to identify the surface's content
+        :return: The rects of the target that were redrawn
+        """
+        layer_key = (screen_key, self.target.get_size())
+        static_layer = _static_layers.get(layer_key)
+        if static_layer is None:
+            static_layer = Surface(self.target.get_size())
+            draw_static(static_layer)
+            _static_layers[layer_key] = static_layer
+
+        elements = [(key, surface, Rect(pos, surface.get_size())) for key, surface, pos in elements]
+        if screen_key != self.screen_key:
+            damaged = [self.target.get_rect()]
+        else:
+            previous = {(key, tuple(rect)) for key, _, rect in self.elements}
+            current = {(key, tuple(rect)) for key, _, rect in elements}
+            damaged = [Rect(rect) for rect in {rect for _, rect in previous ^ current}]
+
+        for damaged_rect in damaged:
+            self.target.blit(static_layer, damaged_rect, damaged_rect)
+            for _, surface, element_rect in elements:
+                if element_rect.colliderect(damaged_rect):
+                    clipped = element_rect.clip(damaged_rect)
+                    self.target.blit(surface, clipped, clipped.move(-element_rect.x, -element_rect.y))
+
+        self.screen_key = screen_key
+        self.elements = elements
+        return damaged
+
+
 class Window:
     """
     Window on a desktop
@@ -30,9 +85,23 @@ class Window:
     def key_input(self, keycode, mod) -> None:
         pass
 
+    def is_dirty(self) -> bool:
+        """
+        Whether the window has changed since it was last rendered
+        :return: True if render needs to be called to bring the surface up to date
+        """
+        return True
+
     def render(self) -> None:
         """
         Draws to the surface that was given to this window
         :return:
         """
-        pass
\ No newline at end of file
+        pass
+
+    def get_damaged_rects(self) -> List[Rect]:
+        """
+        The areas of the surface the last render changed
+        :return: rects in window coordinates
+        """
+        return [self.screen.get_rect()]
\ No newline at end of file